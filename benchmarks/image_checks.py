@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""Compare the speed of the pixel-wise image checks with the whole-buffer implementation.
+
+Run from the root of the repository:
+
+    python3 benchmarks/image_checks.py
+"""
+
+import argparse
+import os.path
+import sys
+import timeit
+from PIL import Image, ImageColor, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from mapnik_legendary.image_utils import images_equal, rgba_only_background
+
+
+def only_background_per_pixel(image, background_color):
+    """Implementation of image_only_background before it was vectorized."""
+    bc = "#ffffff00" if background_color == "transparent" else background_color
+    if len(bc) == 7:
+        bc += "ff"
+    c = ImageColor.getcolor(bc, "RGBA")
+    for x in range(image.width):
+        for y in range(image.height):
+            pixel_color = image.getpixel((x, y))
+            if pixel_color != c and (pixel_color[3] != 0 and pixel_color[3] != c[3]):
+                return False
+    return True
+
+
+def equal_per_pixel(image1, image2):
+    """Implementation of LegendEntry.compare_image before it was vectorized."""
+    if image1.width != image2.width or image1.height != image2.height:
+        return False
+    for x in range(image1.width):
+        for y in range(image1.height):
+            if image1.getpixel((x, y)) != image2.getpixel((x, y)):
+                return False
+    return True
+
+
+def only_background_buffer(image, background_color):
+    return rgba_only_background(image.tobytes(), background_color)
+
+
+def make_images(width, height):
+    """Return an empty image and two identical images with a line. These are the worst cases for the checks."""
+    empty = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    line = Image.new("RGBA", (width, height), (255, 255, 255, 0))
+    ImageDraw.Draw(line).line([(0, height - 1), (width - 1, height - 1)], fill=(200, 30, 30, 255))
+    return empty, line, line.copy()
+
+
+def measure(func, args, number):
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=5, help="Number of calls per measurement")
+    args = parser.parse_args()
+    print("{:<10} {:<16} {:>14} {:>14} {:>9}".format("size", "check", "per pixel [ms]", "buffer [ms]", "speedup"))
+    for width, height in [(100, 60), (512, 512)]:
+        empty, line1, line2 = make_images(width, height)
+        cases = [
+            ("only background", only_background_per_pixel, only_background_buffer, (empty, "transparent")),
+            ("equal", equal_per_pixel, images_equal, (line1, line2)),
+        ]
+        for name, old, new, func_args in cases:
+            assert old(*func_args) == new(*func_args)
+            t_old = measure(old, func_args, args.number)
+            t_new = measure(new, func_args, args.number)
+            print("{:<10} {:<16} {:>14.3f} {:>14.3f} {:>8.0f}x".format(
+                "{}x{}".format(width, height), name, t_old * 1000, t_new * 1000, t_old / t_new
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#! /usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+"""Benchmark legend generation with a synthetic map style.
+
+The map style and the legend file are generated, therefore neither a database nor a checkout of
+a real map style is needed. The whole generate_legend call and the stages of its pipeline are
+timed separately and the results are written as JSON.
+
+Run from the root of the repository:
+
+    python3 benchmarks/legend_suite.py --layers 20 --features 100 -o bench.json
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os.path
+import platform
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import mapnik
+from mapnik_legendary import generate_legend, JSONWriter
+from mapnik_legendary.legend_output import LegendOutput
+from mapnik_legendary.plan import plan_legend
+from mapnik_legendary.profiling import ProfileReport, timed
+from mapnik_legendary.render_cache import CacheStats
+from mapnik_legendary.renderer import LegendRenderer
+from mapnik_legendary.zoom_analysis import scale_denominator
+
+GEOMETRY_TYPES = ["linestring", "polygon", "point"]
+# Number of different values of the tag "feature" per layer
+KINDS = 5
+
+
+def synthetic_map_xml(layers, min_zoom, max_zoom):
+    """Generate a Mapnik XML style with one style per layer and rules changing with the zoom level."""
+    styles = []
+    layer_elements = []
+    for i in range(layers):
+        geom_type = GEOMETRY_TYPES[i % len(GEOMETRY_TYPES)]
+        rules = []
+        for kind in range(KINDS):
+            # Every kind starts on a different zoom level to create scale boundaries.
+            start_zoom = min_zoom + (kind + i) % max(1, max_zoom - min_zoom + 1)
+            color = "#{:02x}{:02x}{:02x}".format((37 * i) % 256, (91 * kind) % 256, (53 * (i + kind)) % 256)
+            if geom_type == "linestring":
+                symbolizer = '<LineSymbolizer stroke="{}" stroke-width="{}" />'.format(color, 1 + kind)
+            elif geom_type == "polygon":
+                symbolizer = '<PolygonSymbolizer fill="{}" /><LineSymbolizer stroke="#000000" stroke-width="0.5" />'.format(color)
+            else:
+                symbolizer = '<MarkersSymbolizer fill="{}" width="{}" height="{}" allow-overlap="true" />'.format(color, 4 + kind, 4 + kind)
+            rules.append("<Rule><MaxScaleDenominator>{:.0f}</MaxScaleDenominator><Filter>([feature] = 'kind_{}')</Filter>{}</Rule>".format(
+                scale_denominator(start_zoom) * 1.5, kind, symbolizer
+            ))
+            rules.append("<Rule><MaxScaleDenominator>{:.0f}</MaxScaleDenominator><Filter>([feature] = 'kind_{}')</Filter>{}</Rule>".format(
+                scale_denominator(start_zoom + 2) * 1.5, kind, symbolizer.replace('stroke-width="', 'stroke-opacity="0.5" stroke-width="')
+            ))
+        styles.append('<Style name="style-{}">{}</Style>'.format(i, "".join(rules)))
+        layer_elements.append('<Layer name="layer-{}" srs="+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0.0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over"><StyleName>style-{}</StyleName></Layer>'.format(i, i))
+    return '<?xml version="1.0" encoding="utf-8"?>\n<Map srs="+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0.0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over">{}{}</Map>\n'.format(
+        "".join(styles), "".join(layer_elements)
+    )
+
+
+def synthetic_legend(layers, features, min_zoom, max_zoom, width, height):
+    """Generate a legend definition with features spread over all layers."""
+    legend = {
+        "width": width,
+        "height": height,
+        "background": "transparent",
+        "features": [],
+        "extra_tags": [],
+    }
+    for j in range(features):
+        layer = j % layers
+        legend["features"].append({
+            "name": "feature-{}".format(j),
+            "type": GEOMETRY_TYPES[layer % len(GEOMETRY_TYPES)],
+            "tags": {"feature": "kind_{}".format(j % KINDS)},
+            "layers": ["layer-{}".format(layer)],
+            "min_zoom": min_zoom,
+            "max_zoom": max_zoom,
+        })
+    return legend
+
+
+def time_stages(legend_yaml, map_xml, base_path, images_dir):
+    """Run the pipeline of generate_legend step by step and collect the timings of its stages.
+
+    The legend items are rendered by LegendRenderer and passed through LegendOutput and JSONWriter
+    like generate_legend does. The stages are the ones recorded by the pipeline itself, see
+    ProfileReport. Parsing, loading the map and planning are timed here.
+    """
+    profile = ProfileReport()
+    with timed(profile.run_timings, "yaml_parsing"):
+        legend = yaml.safe_load(legend_yaml)
+    with timed(profile.run_timings, "map_load"):
+        renderer = LegendRenderer(legend, map_xml, base_path, images_dir, None)
+    with timed(profile.run_timings, "planning"):
+        plan = plan_legend(legend, renderer.layer_styles)
+    output = LegendOutput(JSONWriter(legend["width"], None), io.StringIO(), images_dir, CacheStats(), profile)
+    try:
+        for task in plan.tasks:
+            output.add(task, renderer.render(task))
+        output.finish()
+    finally:
+        renderer.cleanup()
+    return {"run": profile.run_timings, "stages": profile.stage_summary()}, len(plan.tasks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-l", "--layers", type=int, default=20, help="Number of layers and styles in the map style (default: 20)")
+    parser.add_argument("-f", "--features", type=int, default=100, help="Number of features in the legend (default: 100)")
+    parser.add_argument("--min-zoom", type=int, default=12, help="First zoom level of every feature (default: 12)")
+    parser.add_argument("--max-zoom", type=int, default=18, help="Last zoom level of every feature (default: 18)")
+    parser.add_argument("--width", type=int, default=100, help="Image width (default: 100)")
+    parser.add_argument("--height", type=int, default=60, help="Image height (default: 60)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes for the generate_legend run (default: 1)")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"), default=sys.stdout, help="Output file for the results in JSON (default: standard output)")
+    args = parser.parse_args()
+
+    map_xml = synthetic_map_xml(args.layers, args.min_zoom, args.max_zoom)
+    legend_yaml = yaml.safe_dump(synthetic_legend(args.layers, args.features, args.min_zoom, args.max_zoom, args.width, args.height))
+    with tempfile.TemporaryDirectory(prefix="mapnik-legendary-bench-") as work_dir:
+        map_path = os.path.join(work_dir, "map.xml")
+        with open(map_path, "w") as map_file:
+            map_file.write(map_xml)
+        images_dir = os.path.join(work_dir, "images")
+        os.mkdir(images_dir)
+
+        pipeline, task_count = time_stages(legend_yaml, map_xml, work_dir, images_dir)
+
+        with open(map_path, "r") as map_file:
+            output = io.StringIO()
+            start = time.perf_counter()
+            generate_legend(io.StringIO(legend_yaml), map_file, JSONWriter, output_file=output, images_directory=images_dir, jobs=args.jobs)
+            total = time.perf_counter() - start
+
+    result = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "mapnik": mapnik.mapnik_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": {
+            "layers": args.layers,
+            "features": args.features,
+            "min_zoom": args.min_zoom,
+            "max_zoom": args.max_zoom,
+            "width": args.width,
+            "height": args.height,
+            "jobs": args.jobs,
+        },
+        "render_tasks": task_count,
+        "generate_legend": {"total": total, "per_task": total / task_count if task_count else 0.0},
+        "pipeline": pipeline,
+    }
+    json.dump(result, args.output, indent=2)
+    args.output.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#! /usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import argparse
+import logging
+import os.path
+from mapnik_legendary.batch import run_batch
+
+parser = argparse.ArgumentParser(description="Produce several legends in one run, loading every map style once")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes shared by all legends")
+parser.add_argument("-T", "--tmp-dir", type=str, help="Temporary directory for GeoJSON files of the datasources (default: build datasources in memory)")
+parser.add_argument("-c", "--cache-dir", type=str, help="Directory of the render cache, images of unchanged legend items are taken from it")
+parser.add_argument("--cache-size", type=int, default=500, help="Maximum size of the render cache in MiB (default: 500)")
+parser.add_argument("-D", "--strip-datasources", action="store_true", help="Do not open the datasources of the map styles and skip layers not used by any legend")
+parser.add_argument("-d", "--dedupe-images", action="store_true", help="Name images after a hash of their content, identical images are written once")
+parser.add_argument("-F", "--image-format", type=str, help="Format string of the images, e.g. png8:c=128:z=9:t=2:optimize, png32, webp:quality=80 or avif (default: image_format of the legend file or png256:t=2)")
+parser.add_argument("-w", "--write-threads", type=int, default=0, help="Number of threads encoding and writing images while rendering continues (default: 0, write them one after another)")
+parser.add_argument("-P", "--profile-report", type=argparse.FileType("w"), help="Write timings of all stages and legend entries as JSON to this file")
+parser.add_argument("manifest", type=argparse.FileType("r"), help="Manifest listing the legends to produce")
+args = parser.parse_args()
+
+logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+logger = logging.getLogger("mapnik_legendary")
+logger.setLevel(logging.INFO)
+
+if args.tmp_dir is not None and not os.path.isdir(args.tmp_dir):
+    logger.error("Temporary directory {} does not exist".format(args.tmp_dir))
+    exit(1)
+
+if args.jobs < 1:
+    logger.error("Number of jobs must be at least 1")
+    exit(1)
+
+try:
+    run_batch(
+        args.manifest, jobs=args.jobs, tmp_dir=args.tmp_dir, cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024, strip_datasources=args.strip_datasources,
+        dedupe_images=args.dedupe_images, profile_report=args.profile_report,
+        image_format=args.image_format, write_threads=args.write_threads
+    )
+except Exception as e:
+    logger.exception("Mapnik Legendary failed")
+    exit(1)
@@ -0,0 +1,26 @@
+#! /usr/bin/env python3
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import argparse
+import asyncio
+import logging
+from mapnik_legendary.server import LegendServer, RendererCache
+
+parser = argparse.ArgumentParser(description="Render single legend items on request, keeping the map styles loaded")
+parser.add_argument("-H", "--host", type=str, default="localhost", help="Address to listen on (default: localhost)")
+parser.add_argument("-p", "--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+parser.add_argument("-u", "--unix-socket", type=str, help="Listen on a Unix socket instead of a TCP port")
+parser.add_argument("-n", "--max-styles", type=int, default=4, help="Maximum number of map styles kept loaded (default: 4)")
+parser.add_argument("-D", "--strip-datasources", action="store_true", help="Do not open the datasources of the map styles")
+parser.add_argument("-r", "--style-root", type=str, help="Directory containing the map styles, requests for other styles are rejected (default: current directory)")
+args = parser.parse_args()
+
+logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+logger = logging.getLogger("mapnik_legendary")
+logger.setLevel(logging.INFO)
+
+server = LegendServer(RendererCache(args.max_styles, args.strip_datasources, args.style_root))
+try:
+    asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+except KeyboardInterrupt:
+    pass
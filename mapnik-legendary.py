@@ -2,31 +2,72 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 import argparse
+import contextlib
 import logging
 import os.path
-from mapnik_legendary import generate_legend, HTMLWriter, JSONWriter
+import sys
+from mapnik_legendary import generate_legend, HTMLWriter, JSONWriter, StreamingHTMLWriter, StreamingJSONWriter
+from mapnik_legendary.watch import LegendWatcher
 
 parser = argparse.ArgumentParser()
-parser.add_argument("-f", "--format", type=str, help="Output format (html, json)", default="html")
+parser.add_argument("-f", "--format", type=str, help="Output format (html, json, jsonl)", default="html")
 parser.add_argument("-i", "--images-dir", type=str, help="Output directory for images")
-parser.add_argument("-o", "--output-file", type=argparse.FileType("w"), required=True, help="Output file (rendered template)")
+parser.add_argument("-o", "--output-file", type=str, help="Output file (rendered template), required unless --dry-run is used")
 parser.add_argument("-t", "--template", type=argparse.FileType("r"), help="File to read the HTML template from")
-parser.add_argument("-T", "--tmp-dir", type=str, required=True, help="Temporary directory")
+parser.add_argument("-T", "--tmp-dir", type=str, help="Temporary directory for GeoJSON files of the datasources (default: build datasources in memory)")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes rendering the legend items")
+parser.add_argument("-c", "--cache-dir", type=str, help="Directory of the render cache, images of unchanged legend items are taken from it")
+parser.add_argument("--cache-size", type=int, default=500, help="Maximum size of the render cache in MiB (default: 500)")
+parser.add_argument("-s", "--skip-identical-zooms", action="store_true", help="Render only one zoom level of each range of zoom levels on which the styles of a feature do not change")
+parser.add_argument("--verify-skipped-zooms", action="store_true", help="Render all zoom levels and warn if --skip-identical-zooms would have merged zoom levels with different images")
+parser.add_argument("-D", "--strip-datasources", action="store_true", help="Do not open the datasources of the map style and skip layers not used by the legend")
+parser.add_argument("-F", "--image-format", type=str, help="Format string of the images, e.g. png8:c=128:z=9:t=2:optimize, png32, webp:quality=80 or avif (default: image_format of the legend file or png256:t=2)")
+parser.add_argument("-w", "--write-threads", type=int, default=0, help="Number of threads encoding and writing images while rendering continues (default: 0, write them one after another)")
+parser.add_argument("-P", "--profile-report", type=argparse.FileType("w"), help="Write timings of all stages and legend entries as JSON to this file")
+parser.add_argument("-d", "--dedupe-images", action="store_true", help="Name images after a hash of their content, identical images are written once")
+parser.add_argument("-m", "--merge-non-adjacent", action="store_true", help="JSON output: merge entries into any earlier identical entry with adjacent zoom levels, not only the previous one")
+parser.add_argument("--stream", action="store_true", help="Write the output file while the legend items are rendered (always done for jsonl)")
+parser.add_argument("-S", "--sprites", action="store_true", help="Pack all images into sprite sheets instead of writing one file per image")
+parser.add_argument("--sprite-width", type=int, default=1024, help="Maximum width of a sprite sheet (default: 1024)")
+parser.add_argument("-n", "--dry-run", action="store_true", help="Validate the legend file and print the render tasks with their estimated costs without rendering")
+parser.add_argument("-W", "--watch", action="store_true", help="Keep running and render the legend again whenever the legend file, the map style or a file included by it changes")
+parser.add_argument("--watch-interval", type=float, default=0.5, help="Seconds between checks for changed files in watch mode (default: 0.5)")
 parser.add_argument("-z", "--zoom", type=int, default=None, help="Render the legend for the specified zoom level only")
 parser.add_argument("legend_file", type=argparse.FileType("r"), help="Legend file")
 parser.add_argument("map_file", type=argparse.FileType("r"), help="Map file")
 args = parser.parse_args()
+if args.output_file is None and not args.dry_run:
+    parser.error("the following arguments are required: -o/--output-file")
+if args.merge_non_adjacent and (args.format != "json" or args.stream):
+    parser.error("argument -m/--merge-non-adjacent: only supported by -f json without --stream")
+if args.watch and not args.dry_run:
+    # Watch mode renders in a single process, without zoom analysis and without profiling.
+    for flag, used in [
+        ("-j/--jobs", args.jobs != 1), ("-s/--skip-identical-zooms", args.skip_identical_zooms),
+        ("--verify-skipped-zooms", args.verify_skipped_zooms), ("-P/--profile-report", args.profile_report is not None),
+    ]:
+        if used:
+            parser.error("argument -W/--watch: not allowed with argument {}".format(flag))
 
 logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
 logger = logging.getLogger("mapnik_legendary")
 logger.setLevel(logging.INFO)
 
-if not os.path.isdir(args.images_dir):
+if args.images_dir is not None and not os.path.isdir(args.images_dir):
     logger.error("Images output directory {} does not exist".format(args.images_dir))
     exit(1)
 
-if not os.path.isdir(args.tmp_dir):
+if args.tmp_dir is not None and not os.path.isdir(args.tmp_dir):
     logger.error("Temporary directory {} does not exist".format(args.tmp_dir))
+    exit(1)
+
+if args.cache_dir is not None and not os.path.isdir(args.cache_dir):
+    logger.error("Cache directory {} does not exist".format(args.cache_dir))
+    exit(1)
+
+if args.jobs < 1:
+    logger.error("Number of jobs must be at least 1")
+    exit(1)
 
 try:
     template = None
@@ -34,10 +75,52 @@ try:
         template = args.template.read()
 
     writer = HTMLWriter
-    if args.format == "json":
+    writer_options = {}
+    if args.format == "html" and args.stream:
+        writer = StreamingHTMLWriter
+    elif args.format == "json" and args.stream:
+        writer = StreamingJSONWriter
+    elif args.format == "json":
         writer = JSONWriter
+        writer_options["merge_non_adjacent"] = args.merge_non_adjacent
+    elif args.format == "jsonl":
+        writer = StreamingJSONWriter
+        writer_options["json_lines"] = True
+
+    if args.watch and not args.dry_run:
+        args.legend_file.close()
+        args.map_file.close()
+        watcher = LegendWatcher(
+            args.legend_file.name, args.map_file.name, args.output_file, writer, template=template, zoom=args.zoom,
+            images_directory=args.images_dir, tmp_dir=args.tmp_dir, cache_dir=args.cache_dir,
+            cache_size=args.cache_size * 1024 * 1024, strip_datasources=args.strip_datasources,
+            dedupe_images=args.dedupe_images, sprites=args.sprites, sprite_max_width=args.sprite_width,
+            writer_options=writer_options, image_format=args.image_format, write_threads=args.write_threads
+        )
+        try:
+            watcher.watch(args.watch_interval)
+        except KeyboardInterrupt:
+            pass
+        exit(0)
+
+    if args.dry_run:
+        output_context = contextlib.nullcontext(sys.stdout)
+    else:
+        output_context = open(args.output_file, "w")
 
-    generate_legend(args.legend_file, args.map_file, template=template, zoom=args.zoom, images_directory=args.images_dir, output_file=args.output_file, tmp_dir=args.tmp_dir, writer_class=writer)
+    with output_context as output_file:
+        plan = generate_legend(
+            args.legend_file, args.map_file, template=template, zoom=args.zoom, images_directory=args.images_dir,
+            output_file=output_file, tmp_dir=args.tmp_dir, writer_class=writer, jobs=args.jobs,
+            cache_dir=args.cache_dir, cache_size=args.cache_size * 1024 * 1024,
+            skip_identical_zooms=args.skip_identical_zooms, verify_skipped_zooms=args.verify_skipped_zooms,
+            strip_datasources=args.strip_datasources, profile_report=args.profile_report,
+            dedupe_images=args.dedupe_images, sprites=args.sprites, sprite_max_width=args.sprite_width,
+            writer_options=writer_options, dry_run=args.dry_run, image_format=args.image_format,
+            write_threads=args.write_threads
+        )
+    if plan is not None:
+        plan.write(sys.stdout)
 except Exception as e:
     logger.exception("Mapnik Legendary failed")
     exit(1)
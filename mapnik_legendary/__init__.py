@@ -1,3 +1,11 @@
-from .mapnik_legendary import generate_legend
-from .html_writer import HTMLWriter
-from .json_writer import JSONWriter
+from .html_writer import HTMLWriter, StreamingHTMLWriter
+from .json_writer import JSONWriter, StreamingJSONWriter
+
+
+def __getattr__(name):
+    # generate_legend imports Mapnik. It is imported on first use to keep the modules which do not
+    # render (e.g. map_xml, image_utils, sprite_sheet) usable without Mapnik.
+    if name == "generate_legend":
+        from .mapnik_legendary import generate_legend
+        return generate_legend
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
@@ -0,0 +1,182 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import logging
+import os
+import yaml
+from .exceptions import MapnikLegendaryError
+from .feature import layer_names
+from .html_writer import HTMLWriter, StreamingHTMLWriter
+from .json_writer import JSONWriter, StreamingJSONWriter
+from .legend_output import LegendOutput
+from .map_xml import strip_map_xml
+from .mapnik_legendary import make_cache, make_sprite_packer
+from .parallel import render_parallel
+from .plan import plan_legend, validate_legend
+from .profiling import ProfileReport
+from .render_cache import CacheStats
+from .renderer import RendererSet
+
+WRITERS = {
+    "html": HTMLWriter,
+    "json": JSONWriter,
+}
+STREAMING_WRITERS = {
+    "html": StreamingHTMLWriter,
+    "json": StreamingJSONWriter,
+}
+
+
+class BatchJob:
+    """A legend to produce in a batch run, read from an entry of the manifest."""
+    def __init__(self, spec, base_dir, image_format=None):
+        """
+        Args:
+            spec (dict): entry of the manifest
+            base_dir (str): directory relative paths of the manifest are resolved against
+            image_format (str): format string of the images overriding the legend file or None
+        """
+        for key in ["legend", "map", "output"]:
+            if key not in spec:
+                raise MapnikLegendaryError("Key \"{}\" missing in batch job {}".format(key, spec))
+        self.legend_path = os.path.join(base_dir, spec["legend"])
+        self.map_path = os.path.abspath(os.path.join(base_dir, spec["map"]))
+        self.output_path = os.path.join(base_dir, spec["output"])
+        self.images_dir = os.path.join(base_dir, spec.get("images_dir", os.path.dirname(spec["output"])))
+        self.zoom = spec.get("zoom")
+        output_format = spec.get("format", "html")
+        self.writer_options = spec.get("writer_options", {})
+        if output_format == "jsonl":
+            self.writer_class = StreamingJSONWriter
+            self.writer_options["json_lines"] = True
+        elif output_format not in WRITERS:
+            raise MapnikLegendaryError("Unknown output format {} in batch job for {}".format(output_format, self.output_path))
+        elif spec.get("stream", False):
+            self.writer_class = STREAMING_WRITERS[output_format]
+        else:
+            self.writer_class = WRITERS[output_format]
+        self.template = None
+        if "template" in spec:
+            with open(os.path.join(base_dir, spec["template"]), "r") as template_file:
+                self.template = template_file.read()
+        with open(self.legend_path, "r") as legend_file:
+            self.legend = yaml.safe_load(legend_file)
+        if isinstance(self.legend, dict) and image_format is not None:
+            self.legend["image_format"] = image_format
+        try:
+            validate_legend(self.legend)
+        except MapnikLegendaryError as e:
+            raise MapnikLegendaryError("{}: {}".format(self.legend_path, e))
+        self.plan = None
+
+
+def run_batch(manifest_file, **kwargs):
+    """Produce several legends in one run.
+
+    Every map style is loaded once per process and all jobs share the same worker processes. The
+    jobs are scheduled longest first.
+
+    The manifest is a YAML document with a list of jobs:
+
+        jobs:
+          - legend: legend.yml
+            map: style.xml
+            output: output/legend.html
+            template: templates/plain_table.html
+            format: html
+            images_dir: output
+            zoom: 18
+
+    "images_dir" defaults to the directory of the output file, "format" (html, json or jsonl) to html.
+    "zoom" is optional. "stream: true" writes the output file while the legend is rendered.
+    Relative paths are resolved against the directory of the manifest.
+
+    Args:
+        manifest_file (file): File-like object the manifest should be read from
+
+    Keyword Args:
+        jobs (int): Number of worker processes (default: 1)
+        tmp_dir, cache_dir, cache_size, strip_datasources, dedupe_images, sprites, sprite_max_width,
+        sprite_max_height, profile_report, image_format, write_threads: as for generate_legend, applied to all jobs
+    """
+    logger = logging.getLogger("mapnik-legendary")
+    manifest = yaml.safe_load(manifest_file)
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("jobs"), list):
+        raise MapnikLegendaryError("Batch manifest has to contain a list called jobs.")
+    base_dir = os.path.dirname(os.path.abspath(getattr(manifest_file, "name", ".")))
+    batch_jobs = [ BatchJob(spec, base_dir, kwargs.get("image_format")) for spec in manifest["jobs"] ]
+    jobs = kwargs.get("jobs", 1)
+    tmp_dir = kwargs.get("tmp_dir")
+    cache = make_cache(kwargs)
+    cache_stats = CacheStats()
+    profile = ProfileReport() if kwargs.get("profile_report") is not None else None
+
+    # Every style is read once. The legend key of a job is its position in the manifest.
+    style_keys = {}
+    styles = {}
+    legends = {}
+    for legend_key, job in enumerate(batch_jobs):
+        if job.map_path not in style_keys:
+            style_keys[job.map_path] = len(style_keys)
+            with open(job.map_path, "r") as map_file:
+                map_xml = map_file.read()
+            if kwargs.get("strip_datasources", False):
+                used_layers = { l for j in batch_jobs if j.map_path == job.map_path for f in j.legend["features"] for l in layer_names(f) }
+                map_xml = strip_map_xml(map_xml, used_layers, os.path.dirname(job.map_path))
+            styles[style_keys[job.map_path]] = (map_xml, os.path.dirname(job.map_path))
+        legends[legend_key] = (style_keys[job.map_path], job.legend, job.images_dir)
+        # Missing layers are reported by the renderers because the styles are not loaded here.
+        job.plan = plan_legend(job.legend, None, job.zoom)
+
+    order = sorted(range(len(batch_jobs)), key=lambda k: batch_jobs[k].plan.cost(), reverse=True)
+    items = [ (legend_key, task) for legend_key in order for task in batch_jobs[legend_key].plan.tasks ]
+    remaining = { legend_key: len(batch_jobs[legend_key].plan.tasks) for legend_key in order }
+    output_files = {}
+    outputs = {}
+
+    def finish(legend_key):
+        outputs[legend_key].finish()
+        del outputs[legend_key]
+        output_files[legend_key].close()
+        logger.info("Finished {}".format(batch_jobs[legend_key].output_path))
+
+    renderers = None
+    if jobs > 1:
+        entries = render_parallel(items, jobs, styles, legends, tmp_dir, cache)
+    else:
+        renderers = RendererSet(styles, legends, tmp_dir, cache)
+        entries = (renderers.render(legend_key, task) for legend_key, task in items)
+    try:
+        for legend_key in order:
+            job = batch_jobs[legend_key]
+            output_files[legend_key] = open(job.output_path, "w")
+            writer = job.writer_class(job.legend["width"], job.template, **job.writer_options)
+            sprite_packer = make_sprite_packer(kwargs)
+            if sprite_packer is not None:
+                # Jobs may share an images directory.
+                sprite_packer.name = "{}-sprite".format(os.path.splitext(os.path.basename(job.output_path))[0])
+            outputs[legend_key] = LegendOutput(
+                writer, output_files[legend_key], job.images_dir, cache_stats, profile,
+                kwargs.get("dedupe_images", False), sprite_packer, write_threads=kwargs.get("write_threads", 0)
+            )
+        for legend_key in order:
+            if remaining[legend_key] == 0:
+                finish(legend_key)
+        for (legend_key, task), legend_entry in zip(items, entries):
+            outputs[legend_key].add(task, legend_entry)
+            remaining[legend_key] -= 1
+            if remaining[legend_key] == 0:
+                finish(legend_key)
+    except BaseException:
+        for output in outputs.values():
+            output.abort()
+        raise
+    finally:
+        if renderers is not None:
+            renderers.cleanup()
+        for output_file in output_files.values():
+            output_file.close()
+    if profile is not None:
+        profile.write(kwargs["profile_report"])
+    if cache is not None:
+        cache_size = cache.evict()
+        logger.info("Render cache: {}, {} bytes in cache".format(cache_stats, cache_size))
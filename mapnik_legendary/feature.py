@@ -1,8 +1,20 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 from .part import Part
 
+def layer_names(feature):
+    """Return the names of all layers used by a feature definition of the legend file."""
+    names = []
+    for part in feature.get("parts", [feature]):
+        if "layer" in part:
+            names.append(part["layer"])
+        else:
+            names.extend(part.get("layers", []))
+    return names
+
+
 class Feature:
     def __init__(self, feature, zoom, m, extra_tags):
+        self.definition = feature
         self.name = feature["name"]
         self.description = feature.get("description", self.name)
         self.parts = []
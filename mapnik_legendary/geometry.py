@@ -1,14 +1,55 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
+import collections
+import json
 import mapnik
 import geojson
 from .exceptions import MapnikLegendaryError
 
 
+# Geometry types which can be used in the legend file
+GEOMETRY_TYPES = ["point", "point75", "polygon", "linestring-with-gap", "polygon-with-hole", "linestring"]
+# Width of the world in the units of a projection, by projection
+_world_widths = {}
+# Maximum number of geometries kept for reuse. Long-running processes (server, watch mode) see
+# many image sizes.
+MAX_GEOMETRIES = 1024
+# Geometries by type, zoom level, image size and projection, least recently used first, see Geometry.get()
+_geometries = collections.OrderedDict()
+
+
+def world_width(srs):
+    """Return the width of the world in the units of a projection."""
+    if srs not in _world_widths:
+        proj = mapnik.Projection(srs)
+        _world_widths[srs] = proj.forward(mapnik.Coord(180, 0)).x - proj.forward(mapnik.Coord(-180, 0)).x
+    return _world_widths[srs]
+
+
 class Geometry:
+    """Geometry of a legend item covering the image.
+
+    Instances are shared between all parts with the same geometry type, zoom level, image size and
+    projection and must not be modified. Use Geometry.get() to obtain one.
+    """
+
+    def get(geom_type, zoom, m):
+        """Return the geometry for a geometry type and zoom level on a map, build it only once."""
+        key = (geom_type, zoom, m.width, m.height, m.srs)
+        geometry = _geometries.get(key)
+        if geometry is not None:
+            _geometries.move_to_end(key)
+            return geometry
+        geometry = Geometry(geom_type, zoom, m)
+        _geometries[key] = geometry
+        while len(_geometries) > MAX_GEOMETRIES:
+            _geometries.popitem(last=False)
+        return geometry
+
     def __init__(self, geom_type, zoom, m):
-        proj = mapnik.Projection(m.srs)
+        # Identifies equal geometries, see Geometry.get()
+        self.key = (geom_type, zoom, m.width, m.height, m.srs)
         width_of_world_in_pixels = 2**zoom * 256
-        width_of_world_in_metres = proj.forward(mapnik.Coord(180, 0)).x - proj.forward(mapnik.Coord(-180, 0)).x
+        width_of_world_in_metres = world_width(m.srs)
         width_of_image_in_metres = float(m.width) / width_of_world_in_pixels * width_of_world_in_metres
         height_of_image_in_metres = float(m.height) / width_of_world_in_pixels * width_of_world_in_metres
 
@@ -52,6 +93,7 @@ class Geometry:
             self.geom = geojson.LineString([[0, 0.5 * self.max_y], [self.max_x, 0.5 * self.max_y]])
         else:
             raise MapnikLegendaryError("Geometry type {} is not supported for legend entries.".format(geom_type))
+        self.geojson_string = json.dumps(self.geom)
 
     def to_wkt(self):
         return self.geom
@@ -59,5 +101,9 @@ class Geometry:
     def to_geojson(self):
         return self.geom
 
+    def to_geojson_string(self):
+        """Return the geometry serialized as GeoJSON."""
+        return self.geojson_string
+
     def envelope(self):
         return mapnik.Envelope(self.min_x, self.min_y, self.max_x, self.max_y)
@@ -1,5 +1,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import jinja2
+import queue
+import threading
 from .legend_entry import LegendEntry
 
 class HTMLWriter:
@@ -22,3 +24,75 @@ class HTMLWriter:
     def write(self):
         html = self.template.render(entries=self.entries)
         return html
+
+
+class StreamingHTMLWriter(HTMLWriter):
+    """Write the HTML file while the entries are rendered.
+
+    The template is rendered with Template.generate() in a separate thread. The entries variable of
+    the template is an iterator which blocks until the next entry is appended. The last entry is
+    held back until the next one is appended because its images are written meanwhile.
+    """
+
+    streaming = True
+
+    def __init__(self, width, template):
+        """
+        Args:
+            width (int): width of the legend images
+            template (str): content of the template as string
+        """
+        super().__init__(width, template)
+        self.output_file = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.error = None
+        self.last = None
+
+    def begin(self, output_file):
+        """Start writing to a file. Called before the first entry is appended."""
+        self.output_file = output_file
+        self.thread = threading.Thread(target=self.render_template, daemon=True)
+        self.thread.start()
+
+    def iter_entries(self):
+        while True:
+            if self.queue.empty():
+                # Make the output written so far available before waiting for the next entry.
+                self.output_file.flush()
+            legend_entry = self.queue.get()
+            if legend_entry is None:
+                return
+            yield legend_entry
+
+    def render_template(self):
+        try:
+            for chunk in self.template.generate(entries=self.iter_entries()):
+                self.output_file.write(chunk)
+        except Exception as e:
+            self.error = e
+
+    def append(self, legend_entry):
+        if self.error is not None:
+            raise self.error
+        if self.last is not None:
+            self.queue.put(self.last)
+        self.last = legend_entry
+        return True
+
+    def abort(self):
+        """Stop the thread rendering the template if rendering the legend failed."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def write(self):
+        """Wait until the template is rendered completely. Everything has been written then."""
+        if self.last is not None:
+            self.queue.put(self.last)
+            self.last = None
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return ""
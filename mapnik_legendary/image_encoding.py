@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import re
+from PIL import Image
+from .exceptions import MapnikLegendaryError
+
+# Default format string of the legend images
+DEFAULT_IMAGE_FORMAT = "png256:t=2"
+# Formats encoded with Pillow instead of Mapnik, by the name used in format strings
+PILLOW_FORMATS = {
+    "webp": "WEBP",
+    "avif": "AVIF",
+}
+# File name extensions by format name
+EXTENSIONS = {
+    "png": "png",
+    "jpeg": "jpg",
+    "tiff": "tif",
+    "webp": "webp",
+    "avif": "avif",
+}
+# Media types by format name
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "tiff": "image/tiff",
+    "webp": "image/webp",
+    "avif": "image/avif",
+}
+# Flag of a format string requesting a lossless recompression of PNG images
+OPTIMIZE_FLAG = "optimize"
+
+
+def format_name(image_format):
+    """Return the name of the file format of a format string, e.g. png for png8:c=64."""
+    match = re.match(r"[a-z]+", image_format.split(":")[0])
+    if not match:
+        return None
+    return match.group(0)
+
+
+def file_extension(image_format):
+    return EXTENSIONS[format_name(image_format)]
+
+
+def media_type(image_format):
+    return MEDIA_TYPES[format_name(image_format)]
+
+
+def split_format(image_format):
+    """Split a format string into the format string passed to the encoder and the optimize flag."""
+    options = image_format.split(":")
+    optimize = OPTIMIZE_FLAG in options[1:]
+    return ":".join(o for i, o in enumerate(options) if i == 0 or o != OPTIMIZE_FLAG), optimize
+
+
+def check_image_format(image_format):
+    """Raise an error if images cannot be encoded in a format.
+
+    Format strings are Mapnik format strings (e.g. png8:c=128:z=9:t=2, png32, jpeg80) or webp or
+    avif with options quality=N, lossless and method=N, which are encoded by Pillow. The flag
+    optimize recompresses PNG images losslessly with Pillow after encoding.
+    """
+    name = format_name(image_format)
+    if name not in EXTENSIONS:
+        raise MapnikLegendaryError("Image format {} is not supported.".format(image_format))
+    if name in PILLOW_FORMATS:
+        Image.init()
+        if PILLOW_FORMATS[name] not in Image.SAVE:
+            raise MapnikLegendaryError("Image format {} requires Pillow with {} support.".format(image_format, PILLOW_FORMATS[name]))
+        pillow_options(split_format(image_format)[0])
+
+
+def pillow_options(image_format):
+    """Convert the options of a format string to keyword arguments of Image.save()."""
+    options = {}
+    for option in image_format.split(":")[1:]:
+        key, sep, value = option.partition("=")
+        try:
+            if key in ["quality", "q"]:
+                options["quality"] = int(value)
+            elif key == "method":
+                options["method"] = int(value)
+            elif key == "lossless":
+                options["lossless"] = not sep or value not in ["0", "false"]
+            else:
+                raise MapnikLegendaryError("Unknown option {} in image format {}".format(option, image_format))
+        except ValueError:
+            raise MapnikLegendaryError("Option {} in image format {} needs an integer value".format(option, image_format))
+    return options
+
+
+def optimize_png(encoded):
+    """Recompress a PNG image losslessly. Returns the smaller one of the original and the recompressed image."""
+    with Image.open(io.BytesIO(encoded)) as image:
+        output = io.BytesIO()
+        # Palette and transparency are kept, the pixels do not change.
+        image.save(output, "PNG", optimize=True)
+    optimized = output.getvalue()
+    if len(optimized) < len(encoded):
+        return optimized
+    return encoded
+
+
+def pixels_to_mapnik(legend_image):
+    """Create a Mapnik image from the pixels of an image which has not been rendered by Mapnik, e.g. a sprite sheet."""
+    # Imported on first use to keep the formats encoded by Pillow usable without Mapnik.
+    import mapnik
+    output = io.BytesIO()
+    Image.frombytes("RGBA", (legend_image.width, legend_image.height), legend_image.data).save(output, "PNG")
+    return mapnik.Image.fromstring(output.getvalue())
+
+
+def encode_image(legend_image):
+    """Encode a legend image in the format given by its format string.
+
+    Args:
+        legend_image (LegendImage): image to encode, images without mapnik_image are converted to a
+            Mapnik image for Mapnik formats
+
+    Returns:
+        bytes: encoded image
+    """
+    image_format, optimize = split_format(legend_image.image_format)
+    name = format_name(image_format)
+    if name in PILLOW_FORMATS:
+        output = io.BytesIO()
+        image = Image.frombytes("RGBA", (legend_image.width, legend_image.height), legend_image.data)
+        image.save(output, PILLOW_FORMATS[name], **pillow_options(image_format))
+        return output.getvalue()
+    mapnik_image = legend_image.mapnik_image
+    if mapnik_image is None:
+        mapnik_image = pixels_to_mapnik(legend_image)
+    encoded = mapnik_image.tostring(image_format)
+    if optimize and name == "png":
+        encoded = optimize_png(encoded)
+    return encoded
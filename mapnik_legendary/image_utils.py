@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+from PIL import ImageColor
+from .exceptions import MapnikLegendaryError
+
+
+def background_rgba(background_color):
+    """Convert the background color of the legend file to a RGBA tuple."""
+    if background_color == "transparent":
+        bc = "#ffffff00"
+    else:
+        bc = background_color
+    if not bc.startswith("#"):
+        bc = "#{}".format(bc)
+    if len(bc) != 7 and len(bc) != 9:
+        raise MapnikLegendaryError("Background color format not supported. Use #RRGGBB or #RRGGBBAA instead.")
+    if len(bc) == 7:
+        bc += "ff"
+    return ImageColor.getcolor(bc, "RGBA")
+
+
+def rgba_only_background(data, background_color):
+    """Check if raw RGBA pixel data shows background only.
+
+    A pixel counts as background if it has the background color, is fully transparent or has the
+    same alpha value as the background color. A pixel with any other alpha value cannot have the
+    background color. Therefore it is sufficient to look at the alpha channel and this can be done
+    on the whole buffer at once.
+
+    Args:
+        data (bytes): pixel data, 4 bytes per pixel in RGBA order
+        background_color (str): background color as specified in the legend file
+    """
+    c = background_rgba(background_color)
+    alpha = data[3::4]
+    return len(alpha.translate(None, bytes({0, c[3]}))) == 0
+
+
+def images_equal(image1, image2):
+    """Return true if two PIL images are equal (pixel-wise)."""
+    if image1.size != image2.size:
+        return False
+    # Palette images have to be compared by color, not by their palette indexes.
+    if image1.mode != "RGBA":
+        image1 = image1.convert("RGBA")
+    if image2.mode != "RGBA":
+        image2 = image2.convert("RGBA")
+    return image1.tobytes() == image2.tobytes()
@@ -4,29 +4,110 @@ from .legend_entry import LegendEntry
 
 class JSONWriter:
     """Write the HTML file of the legend table."""
-    def __init__(self, width, template, merge_identical_entries=True):
+    def __init__(self, width, template, merge_identical_entries=True, merge_non_adjacent=False):
         """
         Args:
             width (int): width of the legend images
             tempalte (str): content of the template as string
+            merge_non_adjacent (bool): merge an entry into any earlier identical entry with an adjacent zoom
+                range, not only into the last one
         """
         self.entries = []
         self.image_width = width
         self.merge_identical_entries = merge_identical_entries
+        self.merge_non_adjacent = merge_non_adjacent
+        # Entries by description, used to find merge candidates if merge_non_adjacent is set
+        self.entries_by_description = {}
+
+    def merge(self, legend_entry, other):
+        """Extend the zoom range of other by the one of legend_entry if they are adjacent and equal."""
+        if legend_entry.minzoom - 1 != other.maxzoom and legend_entry.maxzoom + 1 != other.minzoom:
+            return False
+        if not legend_entry.equals(other):
+            return False
+        if legend_entry.minzoom - 1 == other.maxzoom:
+            other.maxzoom = legend_entry.maxzoom
+        else:
+            other.minzoom = legend_entry.minzoom
+        return True
 
     def append(self, legend_entry):
-        """Add new legend entry. Returns false if last entry was updated instead."""
+        """Add new legend entry. Returns false if an existing entry was updated instead."""
         if len(self.entries) > 0:
-            last_entry = self.entries[-1]
-            if legend_entry.equals(last_entry):
-                if legend_entry.zoom - 1 == last_entry.maxzoom:
-                    last_entry.maxzoom += 1
-                    return False
-                if legend_entry.zoom + 1 == last_entry.minzoom:
-                    last_entry.minzoom -= 1
-                    return False
+            if self.merge(legend_entry, self.entries[-1]):
+                return False
+            if self.merge_non_adjacent:
+                for other in self.entries_by_description.get(legend_entry.description, []):
+                    if self.merge(legend_entry, other):
+                        return False
         self.entries.append(legend_entry)
+        if self.merge_non_adjacent:
+            self.entries_by_description.setdefault(legend_entry.description, []).append(legend_entry)
         return True
 
     def write(self):
         return json.dumps(self.entries, default=lambda o: o.as_dict())
+
+
+class StreamingJSONWriter(JSONWriter):
+    """Write the entries to the output file while they are rendered.
+
+    Only the last entry is held back because the next one may be merged into it. The output is a
+    JSON array like the one of JSONWriter or JSON Lines (one entry per line).
+    """
+
+    streaming = True
+
+    def __init__(self, width, template, merge_identical_entries=True, json_lines=False):
+        """
+        Args:
+            width (int): width of the legend images
+            template (str): content of the template as string
+            merge_identical_entries (bool): merge an entry into the previous one if they are equal and have
+                adjacent zoom ranges
+            json_lines (bool): write JSON Lines instead of a JSON array
+        """
+        super().__init__(width, template, merge_identical_entries)
+        self.json_lines = json_lines
+        self.output_file = None
+        self.last = None
+        self.count = 0
+
+    def begin(self, output_file):
+        """Start writing to a file. Called before the first entry is appended."""
+        self.output_file = output_file
+        if not self.json_lines:
+            self.output_file.write("[")
+
+    def format_entry(self, legend_entry):
+        text = json.dumps(legend_entry, default=lambda o: o.as_dict())
+        if self.json_lines:
+            return text + "\n"
+        if self.count > 0:
+            return ", " + text
+        return text
+
+    def emit(self, legend_entry):
+        self.output_file.write(self.format_entry(legend_entry))
+        self.output_file.flush()
+        self.count += 1
+
+    def append(self, legend_entry):
+        """Add new legend entry. Returns false if the previous entry was updated instead."""
+        if self.last is not None:
+            if self.merge_identical_entries and self.merge(legend_entry, self.last):
+                return False
+            self.emit(self.last)
+        self.last = legend_entry
+        return True
+
+    def write(self):
+        """Return the rest of the output which has not been written yet."""
+        text = ""
+        if self.last is not None:
+            text = self.format_entry(self.last)
+            self.count += 1
+            self.last = None
+        if not self.json_lines:
+            text += "]"
+        return text
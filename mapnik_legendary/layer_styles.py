@@ -1,10 +1,23 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
+import collections
+import hashlib
 import logging
 import mapnik
 import os
 import re
+import xml.etree.ElementTree as ET
 from .exceptions import MapnikLegendaryError
+from .map_xml import file_hash, style_files
+
+
+def clear_layers(mapnik_map):
+    """Remove all layers from a mapnik.Map instance because mapnik_map.layers.clear() does not work."""
+    length = len(mapnik_map.layers)
+    for i in range(length - 1, -1, -1):
+        # Since no proper method is exposed to delete a layer, we have to fall back to __delitem__
+        mapnik_map.layers.__delitem__(i)
+
 
 class LayerStyles:
 
@@ -12,14 +25,31 @@ class LayerStyles:
     good_chars_re = re.compile("[^-a-zA-Z0-9_]")
 
     """Mapping from layer names to style names in a Mapnik style"""
-    def __init__(self, layers, tmp_dir):
+    def __init__(self, layers, tmp_dir=None, max_datasources=256):
         """
         Args:
             layers(mapnik.Layers): layers of a style
+            tmp_dir(str): directory to write GeoJSON files for the datasources to. If it is None, the
+                datasources are built in memory.
+            max_datasources(int): number of datasources to keep for reuse
         """
         self.styles_by_layer = {}
+        self.style_xml = {}
+        # Attributes of the Map element and its FontSets, serialized by read_style_xml()
+        self.map_settings = ""
+        # Hashes of the files read by the styles (symbols, patterns) by style name, the font
+        # directory by None, see read_style_xml()
+        self.file_hashes = {}
         self.tmp_dir = tmp_dir
         self.tmp_files = set()
+        self.max_datasources = max_datasources
+        # Datasources by Part.datasource_key(), least recently used first
+        self.datasources = collections.OrderedDict()
+        # GeoJSON files of the datasources by Part.datasource_key() if tmp_dir is set
+        self.datasource_files = {}
+        # Names of the layers attached to the map by attach_layers() and the keys of their datasources
+        self.attached_layers = None
+        self.attached_datasources = []
         for l in layers:
             # List comprehension is required to force Python to copy the list of styles. It goes
             # out of scope otherwise.
@@ -30,6 +60,33 @@ class LayerStyles:
         """Get the names of the styles used by a given layer."""
         return self.styles_by_layer.get(layer_name, [])
 
+    def read_style_xml(self, mapnik_map):
+        """Serialize all styles of a map to XML to make them comparable.
+
+        The attributes of the Map element (e.g. buffer-size, font-directory) and the FontSets
+        apply to all styles and are serialized to map_settings. The background color is left out
+        because it is set from the legend file. The files read by the styles are hashed because
+        the XML contains their paths only.
+        """
+        root = ET.fromstring(mapnik.save_map_to_string(mapnik_map))
+        self.style_xml = { s.get("name"): ET.tostring(s, encoding="unicode") for s in root.iter("Style") }
+        # Mapnik stores absolute paths when loading the style.
+        self.file_hashes = {
+            style_name: [ (path, file_hash(path)) for path in sorted(paths) ]
+            for style_name, paths in style_files(root).items()
+        }
+        attributes = sorted((k, v) for k, v in root.attrib.items() if k != "background-color")
+        font_sets = [ ET.tostring(f, encoding="unicode") for f in root.iter("FontSet") ]
+        self.map_settings = repr(attributes) + "".join(font_sets)
+
+    def get_style_xml(self, layer_name):
+        """Get the XML of the styles used by a given layer. read_style_xml() has to be called before."""
+        return [ self.style_xml.get(s, "") for s in self.get_styles(layer_name) ]
+
+    def get_file_hashes(self, layer_name):
+        """Get the hashes of the files read by the styles of a given layer. read_style_xml() has to be called before."""
+        return [ self.file_hashes.get(s, []) for s in self.get_styles(layer_name) ]
+
     def escape_filename(filename):
         return LayerStyles.good_chars_re.sub("_", filename)
 
@@ -40,6 +97,55 @@ class LayerStyles:
 
     def cleanup(self):
         for fname in self.tmp_files:
+            # Another renderer using the same directory may have removed it already.
+            if os.path.exists(fname):
+                os.remove(fname)
+        self.tmp_files.clear()
+        self.datasources.clear()
+        self.datasource_files.clear()
+        self.attached_layers = None
+
+    def memory_datasource(part):
+        """Build a datasource containing the feature of a part without a roundtrip through the file system."""
+        ds = mapnik.MemoryDatasource()
+        context = mapnik.Context()
+        ds.add_feature(mapnik.Feature.from_geojson(part.to_geojson_feature(), context))
+        return ds
+
+    def get_datasource(self, part):
+        """Return a datasource containing the feature of a part.
+
+        Datasources are built once and reused by all parts with equal geometry and tags.
+        """
+        key = part.datasource_key()
+        ds = self.datasources.get(key)
+        if ds is not None:
+            self.datasources.move_to_end(key)
+            return ds
+        if self.tmp_dir is None:
+            ds = LayerStyles.memory_datasource(part)
+        else:
+            # Files are named after the key because a datasource may still read its file.
+            name = "part-{}".format(hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16])
+            with open(self.get_tmp_filename(name), mode="w") as tmp_file:
+                tmp_file_name = tmp_file.name
+                tmp_file.write(part.to_geojson())
+            ds = mapnik.Datasource(type="geojson", file=tmp_file_name)
+            self.datasource_files[key] = tmp_file_name
+        self.datasources[key] = ds
+        while len(self.datasources) > self.max_datasources:
+            self.evict_datasource()
+        return ds
+
+    def evict_datasource(self):
+        """Forget the least recently used datasource and remove its GeoJSON file."""
+        key, ds = self.datasources.popitem(last=False)
+        fname = self.datasource_files.pop(key, None)
+        if fname is None or key in self.attached_datasources:
+            # A file still read by an attached layer is removed by cleanup().
+            return
+        self.tmp_files.discard(fname)
+        if os.path.exists(fname):
             os.remove(fname)
 
     def prepare_layer(self, layer_name, srs, part):
@@ -48,10 +154,41 @@ class LayerStyles:
         if len(styles) == 0:
             self.logger.warn("Can't find layer {} in the Mapnik xml file.".format(layer_name))
             return None
-        with open(self.get_tmp_filename(layer_name), mode="w") as tmp_file:
-            tmp_file_name = tmp_file.name
-            tmp_file.write(part.to_geojson())
-        l.datasource = mapnik.Datasource(type="geojson", file=tmp_file_name)
-        for style in self.get_styles(layer_name):
+        l.datasource = self.get_datasource(part)
+        for style in styles:
             l.styles.append(style)
         return l
+
+    def attach_layers(self, mapnik_map, parts):
+        """Attach the layers needed to render the parts of a feature to a map.
+
+        The layers attached by the previous call are kept if the same layers are needed again, e.g.
+        for the next zoom level of a feature. Only the datasources whose geometry or tags differ
+        are replaced then.
+
+        Args:
+            mapnik_map (mapnik.Map): map the layers of the style were removed from
+            parts (list of Part): parts of the feature, None for parts without layers
+        """
+        wanted = []
+        for part in parts:
+            if not part:
+                continue
+            for layer_name in part.layers:
+                if len(self.get_styles(layer_name)) == 0:
+                    self.logger.warn("Can't find layer {} in the Mapnik xml file.".format(layer_name))
+                    continue
+                wanted.append((layer_name, part))
+        layer_names = [ layer_name for layer_name, part in wanted ]
+        if layer_names != self.attached_layers or len(mapnik_map.layers) != len(layer_names):
+            clear_layers(mapnik_map)
+            for layer_name, part in wanted:
+                mapnik_map.layers.append(self.prepare_layer(layer_name, mapnik_map.srs, part))
+            self.attached_layers = layer_names
+            self.attached_datasources = [ part.datasource_key() for layer_name, part in wanted ]
+            return
+        for i, (layer_name, part) in enumerate(wanted):
+            key = part.datasource_key()
+            if key != self.attached_datasources[i]:
+                mapnik_map.layers[i].datasource = self.get_datasource(part)
+                self.attached_datasources[i] = key
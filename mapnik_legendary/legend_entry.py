@@ -2,7 +2,8 @@
 
 import re
 import os.path
-from PIL import Image, ImageColor
+from PIL import Image
+from .image_utils import images_equal
 
 
 def clean_name(old_id):
@@ -10,42 +11,136 @@ def clean_name(old_id):
     return re.sub(r"[^-a-zA-Z0-9_]+", "", old_id)
 
 
+def scale_suffix(scale_factor):
+    """Return the suffix of file names of images at a scale factor, e.g. @2x."""
+    if scale_factor == 1:
+        return ""
+    return "@{:g}x".format(scale_factor)
+
+
 class LegendEntry:
-    def __init__(self, image, description, zoom, properties, images_directory):
+    def __init__(self, image, description, zoom, properties, images_directory, rendered=None):
+        """
+        Args:
+            image (str): base name of the image file
+            description (str): description of the entry
+            zoom (int): zoom level
+            properties (dict): additional properties of the entry
+            images_directory (str): directory of the image file
+            rendered (LegendImage): rendered image held in memory
+        """
         self.image = image
+        self.rendered = rendered
+        # Images rendered at scale factors other than 1, by scale factor
+        self.variants = {}
         self.image_directory = images_directory
         self.description = description
         self.minzoom = zoom
         self.maxzoom = zoom
         self.zoom = zoom
         self.properties = properties
+        # Set by generate_legend_item if a render cache is used: hit or miss and size of the cache file
+        self.cache_hit = None
+        self.cache_bytes = 0
+        # Time spent in the stages of producing this entry and the layers it was rendered with
+        self.timings = {}
+        self.layers = []
+        # Set by use_content_address(): name of the image file derived from its content
+        self.image_hash = None
+        self.variant_hashes = {}
+        # Set by SpritePacker: name of the sprite sheets by scale factor and position of the image at scale factor 1
+        self.sprite = None
+        # Paths the images have been written to, entries reused by watch mode are not written again
+        self.written = set()
+        # Sizes of the image files by scale factor, set by write_image()
+        self.image_sizes = {}
 
     def as_dict(self):
         a = { k:v for k,v in self.__dict__.items() if k in ["description", "minzoom", "maxzoom", "properties"] }
         a["image"] = self.get_image_file_path()
+        a["format"] = self.image_format()
+        a["bytes"] = self.image_bytes()
+        if self.variants:
+            a["srcset"] = { "{:g}x".format(s): self.get_image_file_path(s) for s in self.scale_factors() }
+        if self.sprite is not None:
+            a["sprite"] = { k: self.sprite[k] for k in ["x", "y", "width", "height"] }
+            if self.variants:
+                # Needed to scale down the sheets of the other scale factors (CSS background-size)
+                a["sprite"]["sheet_width"] = self.sprite["sheet_width"]
+                a["sprite"]["sheet_height"] = self.sprite["sheet_height"]
         return a
 
-    def image_name(self):
-        return "{}-{}.png".format(self.image, self.zoom)
+    def scale_factors(self):
+        """Return the scale factors this entry has images for."""
+        return [1] + sorted(self.variants)
+
+    def image_for(self, scale_factor):
+        """Return the image rendered at a scale factor."""
+        if scale_factor == 1:
+            return self.rendered
+        return self.variants[scale_factor]
+
+    def image_name(self, scale_factor=1):
+        if self.sprite is not None:
+            return self.sprite["sheets"][scale_factor]
+        image = self.image_for(scale_factor)
+        extension = image.extension() if image is not None else "png"
+        if self.image_hash is not None:
+            if scale_factor == 1:
+                return "{}.{}".format(self.image_hash, extension)
+            return "{}.{}".format(self.variant_hashes[scale_factor], extension)
+        return "{}-{}{}.{}".format(self.image, self.zoom, scale_suffix(scale_factor), extension)
+
+    def image_format(self):
+        """Return the file format of the image, e.g. png or webp."""
+        return self.rendered.extension()
 
-    def get_image_file_path(self):
-        return os.path.join(self.image_directory, self.image_name())
+    def image_bytes(self, scale_factor=1):
+        """Return the size of the image file at a scale factor or None if it has not been written yet."""
+        return self.image_sizes.get(scale_factor)
+
+    def srcset(self):
+        """Return the value of the srcset attribute of an HTML img element showing this entry."""
+        return ", ".join("{} {:g}x".format(self.image_name(s), s) for s in self.scale_factors())
+
+    def use_content_address(self):
+        """Name the image files after the hash of their content. Entries with equal images share one file."""
+        self.image_hash = self.rendered.digest()[:32]
+        self.variant_hashes = { s: image.digest()[:32] for s, image in self.variants.items() }
+
+    def get_image_file_path(self, scale_factor=1):
+        return os.path.join(self.image_directory, self.image_name(scale_factor))
 
     def equals(self, other):
         return self.description == other.description and self.properties == other.properties and self.compare_image(other)
 
+    def write_image(self):
+        """Write the rendered images of all scale factors to the images directory."""
+        for scale_factor in self.scale_factors():
+            path = self.get_image_file_path(scale_factor)
+            if (self.image_hash is not None or path in self.written) and os.path.exists(path):
+                # An image file named after its content does not have to be written again.
+                self.image_sizes[scale_factor] = os.path.getsize(path)
+                continue
+            image = self.image_for(scale_factor)
+            image.save(path)
+            self.image_sizes[scale_factor] = len(image.encode())
+            self.written.add(path)
+
+    def release_images(self):
+        """Free the pixel data of the images, see LegendImage.release()."""
+        for scale_factor in self.scale_factors():
+            self.image_for(scale_factor).release()
+
     def compare_image(self, other):
-        """Return true if image of this entry and another entry is equal (pixel-wise)."""
-        with Image.open(self.get_image_file_path()) as image1:
-            width1 = image1.width
-            height1 = image1.height
-            with Image.open(other.get_image_file_path()) as image2:
-                width2 = image2.width
-                height2 = image2.height
-                if width1 != width2 or height1 != height2:
-                    return False
-                for x in range(width1):
-                    for y in range(height1):
-                        if image1.getpixel((x, y)) != image2.getpixel((x, y)):
-                            return False
+        """Return true if the images of this entry and another entry are equal (pixel-wise) at all scale factors."""
+        if self.scale_factors() != other.scale_factors():
+            return False
+        if self.rendered is not None and other.rendered is not None:
+            return all(self.image_for(s).equals(other.image_for(s)) for s in self.scale_factors())
+        for scale_factor in self.scale_factors():
+            with Image.open(self.get_image_file_path(scale_factor)) as image1:
+                with Image.open(other.get_image_file_path(scale_factor)) as image2:
+                    if not images_equal(image1, image2):
+                        return False
         return True
@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import hashlib
+import io
+import os
+import threading
+from PIL import Image
+from .image_encoding import encode_image, file_extension
+from .image_utils import rgba_only_background
+
+
+class LegendImage:
+    """Rendered image of a legend entry which is kept in memory until it is written to disk."""
+    def __init__(self, width, height, data, image_format, mapnik_image=None, encoded=None):
+        """
+        Args:
+            width (int): width of the image
+            height (int): height of the image
+            data (bytes): pixel data, 4 bytes per pixel in RGBA order without premultiplied alpha, None
+                after release()
+            image_format (str): format string used to encode the image, see check_image_format()
+            mapnik_image (mapnik.Image): rendered image, required if encoded is None and the image is
+                encoded by Mapnik
+            encoded (bytes): already encoded image
+        """
+        self.width = width
+        self.height = height
+        self.data = data
+        self.image_format = image_format
+        self.mapnik_image = mapnik_image
+        self.encoded = encoded
+        self.content_hash = None
+        # Images are encoded by the threads writing them and by the writers reporting their size.
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_mapnik(cls, mapnik_image, image_format):
+        mapnik_image.demultiply()
+        return cls(mapnik_image.width(), mapnik_image.height(), mapnik_image.tostring(), image_format, mapnik_image)
+
+    def __getstate__(self):
+        # mapnik.Image cannot be pickled. The image is encoded before it is sent to another process.
+        state = self.__dict__.copy()
+        state["encoded"] = self.encode()
+        state["mapnik_image"] = None
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def encode(self):
+        """Return the encoded image. It is encoded on the first call only."""
+        with self.lock:
+            if self.encoded is None:
+                self.encoded = encode_image(self)
+                # The image rendered by Mapnik is not needed anymore, the pixels are kept in data.
+                self.mapnik_image = None
+        return self.encoded
+
+    def release(self):
+        """Free the pixel data once the image has been compared and written. Only the encoded image and its hash are kept."""
+        self.encode()
+        self.digest()
+        self.data = None
+
+    def pil_image(self):
+        """Return the image as PIL image, decoded from the encoded image after release()."""
+        if self.data is None:
+            with Image.open(io.BytesIO(self.encode())) as image:
+                return image.convert("RGBA")
+        return Image.frombytes("RGBA", (self.width, self.height), self.data)
+
+    def extension(self):
+        """Return the file name extension of the encoded image."""
+        return file_extension(self.image_format)
+
+    def save(self, path):
+        # Write to a temporary file first to never leave a truncated image behind.
+        tmp_path = "{}.tmp-{}-{}".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as image_file:
+            image_file.write(self.encode())
+        os.replace(tmp_path, path)
+
+    def digest(self):
+        """Return a hash of the pixels and the output format of the image."""
+        if self.content_hash is None:
+            h = hashlib.sha256()
+            h.update("{} {} {}\n".format(self.width, self.height, self.image_format).encode("utf-8"))
+            h.update(self.data)
+            self.content_hash = h.hexdigest()
+        return self.content_hash
+
+    def only_background(self, background_color):
+        """Check if the image shows background only."""
+        return rgba_only_background(self.data, background_color)
+
+    def equals(self, other):
+        """Return true if this image and another image are equal (pixel-wise)."""
+        # The data may be released by a thread writing the images meanwhile.
+        data = self.data
+        other_data = other.data
+        if data is None or other_data is None:
+            return self.digest() == other.digest()
+        return self.width == other.width and self.height == other.height and data == other_data
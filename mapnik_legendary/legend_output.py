@@ -0,0 +1,131 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import concurrent.futures
+import logging
+from .exceptions import MapnikLegendaryError
+from .profiling import timed
+
+
+class LegendOutput:
+    """Pass the rendered entries of a legend to its writer, write their images and finally the output file."""
+
+    logger = logging.getLogger("mapnik-legendary")
+
+    def __init__(self, writer, output_file, images_dir, cache_stats, profile, dedupe_images=False, sprite_packer=None, zoom_group_start=None, write_threads=0):
+        """
+        Args:
+            writer (HTMLWriter or JSONWriter): writer of the output format. Streaming writers (attribute streaming
+                is true) start writing to the output file immediately.
+            output_file (file): file-like object to write the output to
+            images_dir (str): directory to write the images to
+            cache_stats (CacheStats): statistics of the render cache to update
+            profile (ProfileReport): report to add the timings of the entries to or None
+            dedupe_images (bool): name images after a hash of their content
+            sprite_packer (SpritePacker): pack the images into sprite sheets instead of writing them one by one
+            zoom_group_start (dict): first zoom level of the range of zoom levels expected to look the same by
+                (feature index, zoom level), only set to verify the zoom analysis
+            write_threads (int): number of threads encoding and writing the images while the next items are
+                rendered, 0 to write them immediately
+        """
+        self.writer = writer
+        self.output_file = output_file
+        self.images_dir = images_dir
+        self.cache_stats = cache_stats
+        self.profile = profile
+        self.run_timings = profile.run_timings if profile is not None else {}
+        self.dedupe_images = dedupe_images
+        self.sprite_packer = sprite_packer
+        self.zoom_group_start = zoom_group_start
+        self.streaming = getattr(writer, "streaming", False)
+        if self.streaming:
+            if sprite_packer is not None:
+                raise MapnikLegendaryError("Sprite sheets cannot be used with a streaming writer because the positions of the images are known only at the end.")
+            writer.begin(output_file)
+        self.executor = None
+        if write_threads > 0:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=write_threads)
+        # Images being written by the executor
+        self.pending_writes = []
+        # Write of the images of the last appended entry
+        self.last_write = None
+        # Entries whose images go into the sprite sheets
+        self.sprite_entries = []
+        # Entries rendered on the first zoom level of a range expected to look the same, used for verification
+        self.group_entries = {}
+
+    def verify_zoom_group(self, task, legend_entry):
+        group_key = (task.index, self.zoom_group_start[(task.index, task.zoom)])
+        if group_key[1] == task.zoom:
+            self.group_entries[group_key] = legend_entry
+        elif not legend_entry.compare_image(self.group_entries[group_key]):
+            self.logger.warn("Zoom analysis expected feature \"{}\" on zoom {} to look like on zoom {} but the images differ.".format(
+                legend_entry.description, task.zoom, group_key[1]
+            ))
+
+    def add(self, task, legend_entry):
+        """Add a rendered entry. Entries have to be added in the order of their tasks."""
+        self.cache_stats.count(legend_entry)
+        if self.zoom_group_start is not None:
+            self.verify_zoom_group(task, legend_entry)
+        if self.dedupe_images:
+            legend_entry.use_content_address()
+        if self.streaming and self.last_write is not None:
+            # Streaming writers emit the previous entry now. They report the size of its images.
+            self.last_write.result()
+        self.last_write = None
+        with timed(legend_entry.timings, "writer_append"):
+            appended = self.writer.append(legend_entry)
+        # The image is not needed if the entry was merged into the previous one.
+        if appended and self.sprite_packer is not None:
+            self.sprite_entries.append(legend_entry)
+        elif appended and self.executor is not None:
+            self.check_writes()
+            self.last_write = self.executor.submit(self.write_image, legend_entry)
+            self.pending_writes.append(self.last_write)
+        elif appended:
+            with timed(legend_entry.timings, "write_image"):
+                self.write_image(legend_entry)
+        elif legend_entry.rendered is not None:
+            legend_entry.release_images()
+        if self.profile is not None:
+            self.profile.add_entry(task, legend_entry)
+
+    def write_image(self, legend_entry):
+        """Write the images of an entry and free their pixel data, entries are compared by hash afterwards."""
+        legend_entry.write_image()
+        legend_entry.release_images()
+
+    def check_writes(self, wait=False):
+        """Forget finished image writes and raise their exceptions. Waits for all writes if wait is true."""
+        if wait:
+            concurrent.futures.wait(self.pending_writes)
+        pending = []
+        for future in self.pending_writes:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.pending_writes = pending
+
+    def abort(self):
+        """Stop writing after an error. Pending image writes are cancelled, a streaming writer stops."""
+        if self.executor is not None:
+            for future in self.pending_writes:
+                future.cancel()
+            self.executor.shutdown()
+            self.pending_writes = []
+        if hasattr(self.writer, "abort"):
+            self.writer.abort()
+
+    def finish(self):
+        """Write the sprite sheets and the output file."""
+        if self.executor is not None:
+            with timed(self.run_timings, "write_images"):
+                self.check_writes(True)
+            self.executor.shutdown()
+        if self.sprite_packer is not None:
+            with timed(self.run_timings, "sprites"):
+                self.sprite_packer.write(self.sprite_entries, self.images_dir)
+        with timed(self.run_timings, "writer_write"):
+            self.output_file.write(self.writer.write())
+            self.output_file.flush()
@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import hashlib
+import os
+import re
+import xml.etree.ElementTree as ET
+from .exceptions import MapnikLegendaryError
+
+# Declaration of an external entity, used by many Mapnik XML styles to include files. Parameter
+# entities (with %) include declarations into the document type declaration.
+ENTITY_RE = re.compile(r"<!ENTITY\s+(%\s+)?([-\w.:]+)\s+SYSTEM\s+([\"'])(.*?)\3\s*>", re.S)
+# Internal subset of the document type declaration
+DOCTYPE_RE = re.compile(r"<!DOCTYPE\s+[-\w.:]+\s*\[(.*?)\]\s*>", re.S)
+XML_DECLARATION_RE = re.compile(r"^\s*<\?xml[^>]*\?>")
+ENTITY_REFERENCE_RE = re.compile(r"&([-\w.:]+);")
+# Maximum nesting depth of included files
+MAX_INCLUDE_DEPTH = 8
+
+
+def included_files(path, seen=None):
+    """Return the files included by a Mapnik XML style through external entities, recursively."""
+    if seen is None:
+        seen = set()
+    try:
+        with open(path, "r") as xml_file:
+            content = xml_file.read()
+    except OSError:
+        return seen
+    for match in ENTITY_RE.finditer(content):
+        included = os.path.normpath(os.path.join(os.path.dirname(path), match.group(4)))
+        if included not in seen:
+            seen.add(included)
+            included_files(included, seen)
+    return seen
+
+
+def read_included_file(path):
+    try:
+        with open(path, "r") as included_file:
+            return XML_DECLARATION_RE.sub("", included_file.read(), count=1)
+    except OSError as err:
+        raise MapnikLegendaryError("Cannot read file included by the map style: {}".format(err))
+
+
+def rebase_entities(declarations, directory):
+    """Prefix the paths of the external entities declared in an included file with the directory of the file.
+
+    The paths of external entities are relative to the file declaring them.
+    """
+    def rebase(m):
+        return m.string[m.start():m.start(4)] + os.path.join(directory, m.group(4)) + m.string[m.end(4):m.end()]
+    return ENTITY_RE.sub(rebase, declarations)
+
+
+def resolve_entities(map_xml, base_path):
+    """Replace the references to external entities of a Mapnik XML style by the content of the included files.
+
+    The XML parser of the standard library does not load external entities.
+
+    Args:
+        map_xml (str): content of the Mapnik XML style
+        base_path (str): directory of the style, the paths of the included files are relative to
+            the directory of the file declaring them
+
+    Returns:
+        str: Mapnik XML style without external entities
+    """
+    match = DOCTYPE_RE.search(map_xml)
+    if match is None:
+        return map_xml
+    subset = match.group(1)
+    for _ in range(MAX_INCLUDE_DEPTH):
+        parameter_entities = {}
+        def declare_parameter_entity(m):
+            if not m.group(1):
+                return m.group(0)
+            content = read_included_file(os.path.join(base_path, m.group(4)))
+            parameter_entities[m.group(2)] = rebase_entities(content, os.path.dirname(m.group(4)))
+            return ""
+        subset = ENTITY_RE.sub(declare_parameter_entity, subset)
+        if not parameter_entities:
+            break
+        for name, content in parameter_entities.items():
+            subset = subset.replace("%{};".format(name), content)
+    entities = {}
+    def declare_entity(m):
+        entities[m.group(2)] = read_included_file(os.path.join(base_path, m.group(4)))
+        return ""
+    subset = ENTITY_RE.sub(declare_entity, subset)
+    body = map_xml[match.end():]
+    for _ in range(MAX_INCLUDE_DEPTH):
+        resolved = ENTITY_REFERENCE_RE.sub(lambda m: entities.get(m.group(1), m.group(0)), body)
+        if resolved == body:
+            break
+        body = resolved
+    # Internal entities are left to the XML parser.
+    return map_xml[:match.start(1)] + subset + map_xml[match.end(1):match.end()] + body
+
+
+def file_hash(path):
+    """Return a hash of the content of a file, of the names and modification times of the files of a directory or None if it is missing."""
+    h = hashlib.sha256()
+    try:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                h.update("{} {}\n".format(name, os.stat(os.path.join(path, name)).st_mtime_ns).encode("utf-8"))
+        else:
+            with open(path, "rb") as f:
+                h.update(f.read())
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def referenced_files(map_xml, base_path=""):
+    """Return the files a Mapnik XML style reads while rendering, e.g. symbols and patterns.
+
+    Files named by expressions (e.g. symbols/[shop].svg) are left out.
+
+    Args:
+        map_xml (str): content of the Mapnik XML style
+        base_path (str): directory relative paths are relative to
+
+    Returns:
+        dict: sets of paths by style name, the font directory used by all styles by None
+    """
+    try:
+        root = ET.fromstring(resolve_entities(map_xml, base_path))
+    except ET.ParseError as err:
+        raise MapnikLegendaryError("Cannot parse the map style: {}".format(err))
+    return style_files(root, base_path)
+
+
+def style_files(root, base_path=""):
+    """Return the files read by the styles of a parsed Mapnik XML style, see referenced_files()."""
+    base = os.path.join(base_path, root.get("base", ""))
+    files = {None: set()}
+    if root.get("font-directory"):
+        files[None].add(os.path.normpath(os.path.join(base, root.get("font-directory"))))
+    for style in root.iter("Style"):
+        paths = files.setdefault(style.get("name"), set())
+        for element in style.iter():
+            path = element.get("file")
+            if path and "[" not in path:
+                paths.add(os.path.normpath(os.path.join(base, path)))
+    return files
+
+
+def strip_map_xml(map_xml, layer_names, base_path=""):
+    """Remove everything from a Mapnik XML style which is not needed to render legend items.
+
+    Datasources are removed because they are replaced by generated ones anyway. Opening them
+    requires database connections or reading and indexing shapefiles. Layers not used by the
+    legend and styles not used by the remaining layers are removed to speed up parsing.
+
+    Args:
+        map_xml (str): content of the Mapnik XML style
+        layer_names (set of str): names of the layers used by the legend or None to keep all layers
+        base_path (str): directory the paths of files included through external entities are relative to
+
+    Returns:
+        str: stripped Mapnik XML style, external entities are resolved
+    """
+    try:
+        root = ET.fromstring(resolve_entities(map_xml, base_path))
+    except ET.ParseError as err:
+        raise MapnikLegendaryError("Cannot strip the datasources from the map style: {}".format(err))
+    used_styles = set()
+    for parent in list(root.iter()):
+        for child in list(parent):
+            if child.tag == "Datasource":
+                parent.remove(child)
+            elif child.tag == "Layer" and layer_names is not None and child.get("name") not in layer_names:
+                parent.remove(child)
+    for layer in root.iter("Layer"):
+        for style_name in layer.iter("StyleName"):
+            used_styles.add((style_name.text or "").strip())
+    for style in root.findall("Style"):
+        if style.get("name") not in used_styles:
+            root.remove(style)
+    return ET.tostring(root, encoding="unicode")
@@ -1,89 +1,38 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
 import logging
-import mapnik
 import os
 import sys
 import yaml
-from PIL import Image, ImageColor
-from .feature import Feature
 from .exceptions import MapnikLegendaryError
+from .feature import layer_names
 from .layer_styles import LayerStyles
-from .legend_entry import clean_name, LegendEntry
+from .legend_output import LegendOutput
+from .map_xml import strip_map_xml
+from .parallel import render_parallel
+from .plan import plan_legend, validate_legend
+from .profiling import ProfileReport, timed
+from .render_cache import CacheStats, RenderCache
+from .renderer import load_map, LegendRenderer
+from .sprite_sheet import SpritePacker
+from .zoom_analysis import ZoomAnalysis
 
+# Default maximum size of the render cache in bytes
+DEFAULT_CACHE_SIZE = 500 * 1024 * 1024
 
-def clear_layers(mapnik_map):
-    """Remove all layers from a mapnik.Map instance because mapnik_map.layers.clear() does not work."""
-    length = len(mapnik_map.layers)
-    for i in range(length - 1, -1, -1):
-        # Since no proper method is exposed to delete a layer, we have to fall back to __delitem__
-        mapnik_map.layers.__delitem__(i)
 
+def make_cache(options):
+    """Create the render cache requested by the keyword arguments of generate_legend or None."""
+    if options.get("cache_dir") is None:
+        return None
+    return RenderCache(options["cache_dir"], options.get("cache_size", DEFAULT_CACHE_SIZE))
 
-def image_only_background(path, background_color):
-    """Check if the image shows background only."""
-    with Image.open(path) as image:
-        if background_color == "transparent":
-            bc = "#ffffff00"
-        else:
-            bc = background_color
-        width = image.width
-        height = image.height
-        if not bc.startswith("#"):
-            bc = "#{}".format(bc)
-        if len(bc) != 7 and len(bc) != 9:
-            raise MapnikLegendaryError("Background color format not supported. Use #RRGGBB or #RRGGBBAA instead.")
-        if len(bc) == 7:
-            bc += "ff"
-        if image.mode != "RGBA":
-            image = image.convert("RGBA")
-        c = ImageColor.getcolor(bc, "RGBA")
-        for x in range(width):
-            for y in range(height):
-                pixel_color = image.getpixel((x, y))
-                if pixel_color != c and (pixel_color[3] != 0 and pixel_color[3] != c[3]):
-                    return False
-        return True
 
-
-def generate_legend_item(mapnik_map, layer_styles, feature, zoom_level, background_color, properties, images_dir):
-    """Render a legend item.
-
-    Returns:
-        Tuple (filename of the image, description)
-    """
-    logger = logging.getLogger("mapnik-legendary")
-    logger.info("Rendering feature {} on zoom level {}".format(feature.name, zoom_level))
-    mapnik_map.zoom_to_box(feature.envelope())
-    clear_layers(mapnik_map)
-
-    for part in feature.parts:
-        if not part:
-            logger.warn("Can't find any layers defined for a part of {}".format(feature.name))
-            continue
-        for layer_name in part.layers:
-            l = layer_styles.prepare_layer(layer_name, mapnik_map.srs, part)
-            if l:
-                mapnik_map.layers.append(l)
-
-    fid = feature.name
-    if not fid:
-        fid = "legend-{}".format(idx)
-    fid = clean_name(fid)
-    legend_entry = LegendEntry(fid, feature.description, zoom_level, properties, images_dir)
-    filename = legend_entry.get_image_file_path()
-    try:
-        mapnik.render_to_file(mapnik_map, filename, "png256:t=2")
-    except Exception as e:
-        r = r"^CSV Plugin: no attribute '([^']+)'"
-        match_data = re.match(r, str(e))
-        if match_data:
-            raise MapnikLegendaryError("{} is a key needed for feature \"{}\" on zoom level {}. Try adding {} to the extra_tags list.\n".format(match_data.group(1), feature.name, zoom_level, match_data.group(1)))
-        else:
-            raise e
-    if image_only_background(filename, background_color):
-        logger.warn("Feature \"{}\" on zoom {} not rendered, legend image is empty.".format(feature.name, zoom_level))
-    return legend_entry
+def make_sprite_packer(options):
+    """Create the sprite packer requested by the keyword arguments of generate_legend or None."""
+    if not options.get("sprites", False):
+        return None
+    return SpritePacker(options.get("sprite_max_width", 1024), options.get("sprite_max_height", 4096))
 
 
 def generate_legend(legend_file, map_file, writer_class, **kwargs):#output_directory, zoom=None, overwrite=False):
@@ -92,7 +41,8 @@ def generate_legend(legend_file, map_file, writer_class, **kwargs):#output_direc
     Args:
         legend_file (file): File-like object the YAML document defining the items of the legend should be read from
         map_file (file): File-like object the Mapnik XML map style should be read from
-        writer_class (class): instance of class implementing the output format
+        writer_class (class): instance of class implementing the output format. Streaming writers
+            (StreamingHTMLWriter, StreamingJSONWriter) write the output file while the items are rendered.
 
     Keyword Args:
         output_file (file): File-like object to write the rendered template to (default: sys.stdout)
@@ -101,6 +51,38 @@ def generate_legend(legend_file, map_file, writer_class, **kwargs):#output_direc
         zoom (int): The zoom level the legend should be produced for (defaults to None). If it is not provided,
             all zoom levels specified in the legend file will be produced.
         template (str): Jinja2 template to render
+        tmp_dir (str): Directory for temporary GeoJSON files of the datasources (defaults to None). If it is not
+            provided, the datasources are built in memory.
+        jobs (int): Number of worker processes rendering the legend items (default: 1). The entries are passed to
+            the writer in the same order as if they were rendered by a single process.
+        cache_dir (str): Directory of the render cache (defaults to None). If it is provided, images of legend items
+            whose definition, size and styles did not change since a previous run are taken from the cache.
+        cache_size (int): Maximum size of the render cache in bytes. The least recently used images are removed
+            at the end of the run if the cache is larger.
+        skip_identical_zooms (bool): Render only one zoom level of each range of zoom levels on which the styles of a
+            feature select the same rules and emit one entry for the whole range (default: False).
+        verify_skipped_zooms (bool): Render all zoom levels but warn if the images of a range of zoom levels expected
+            to look the same by the zoom analysis differ (default: False).
+        strip_datasources (bool): Remove all datasources, all layers not used by the legend and their styles from
+            the map style before loading it (default: False). No database or shapefiles are needed then.
+        dedupe_images (bool): Name image files after a hash of their content (default: False). Entries with equal
+            images share one file which is written only once.
+        sprites (bool): Pack all images into sprite sheets instead of writing one file per image (default: False).
+            The entries refer to the sprite sheet and their position in it.
+        sprite_max_width (int): Maximum width of a sprite sheet (default: 1024)
+        sprite_max_height (int): Maximum height of a sprite sheet (default: 4096). More sheets are written if the
+            images do not fit into one.
+        writer_options (dict): Keyword arguments passed to the constructor of the writer class (defaults to {}).
+        profile_report (file): File-like object to write a JSON report with the time spent in each stage of each
+            legend entry, aggregated timings and the slowest features to (defaults to None).
+        dry_run (bool): Validate the legend and return the render plan without rendering anything (default: False).
+        image_format (str): Format string of the images, overrides image_format of the legend file, see
+            check_image_format() (defaults to the legend file or png256:t=2).
+        write_threads (int): Number of threads encoding and writing the images while the next items are rendered
+            (default: 0, write them one after another).
+
+    Returns:
+        RenderPlan: the plan of the legend if dry_run is set, None otherwise
     """
         
     logger = logging.getLogger("mapnik-legendary")
@@ -108,67 +90,79 @@ def generate_legend(legend_file, map_file, writer_class, **kwargs):#output_direc
     zoom = kwargs.get("zoom")
     output_file = kwargs.get("output_file", sys.stdout)
     images_dir = kwargs.get("images_directory")
+    dry_run = kwargs.get("dry_run", False)
     if output_file != sys.stdout and images_dir is None:
         images_dir = os.path.dirname(os.path.abspath(output_file.name))
-    elif output_file == sys.stdout and images_dir is None:
+    elif output_file == sys.stdout and images_dir is None and not dry_run:
         raise MapnikLegendaryError("Cannot guess images output directory because the output file is not a regular file (e.g. standard output)")
     legend = yaml.safe_load(legend_file)
-    if "fonts_dir" in legend:
-        mapnik.FontEngine.register_fonts(legend["fonts_dir"])
-    srs = "+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0.0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over"
-    if "width" not in legend or "height" not in legend:
-        raise MapnikLegendaryError("width or height not specified in legend definition")
-    m = mapnik.Map(legend['width'], legend['height'], srs)
-    mapnik.load_map_from_string(m, map_file.read().encode("utf-8"), False, os.path.dirname(map_file.name))
-    default_width = legend['width']
-    default_height = legend['height']
-    m.width = default_width
-    m.height = default_height
-    background_color = legend.get("background", "transparent")
-    if background_color == "transparent":
-        m.background = mapnik.Color(255, 255, 255, 0)
+    if isinstance(legend, dict) and kwargs.get("image_format") is not None:
+        legend["image_format"] = kwargs["image_format"]
+    validate_legend(legend)
+    map_xml = map_file.read()
+    base_path = os.path.dirname(map_file.name)
+    if kwargs.get("strip_datasources", False):
+        map_xml = strip_map_xml(map_xml, { l for feature in legend["features"] for l in layer_names(feature) }, base_path)
+    jobs = kwargs.get("jobs", 1)
+    tmp_dir = kwargs.get("tmp_dir")
+    skip_identical_zooms = kwargs.get("skip_identical_zooms", False)
+    verify_skipped_zooms = kwargs.get("verify_skipped_zooms", False)
+    cache = make_cache(kwargs)
+    cache_stats = CacheStats()
+    profile_report_file = kwargs.get("profile_report")
+    # Timings are collected only if a report is requested.
+    profile = ProfileReport() if profile_report_file is not None else None
+    run_timings = profile.run_timings if profile is not None else {}
+
+    # Planning stage: the legend is checked against the styles of the map and expanded into tasks
+    # before anything is rendered.
+    renderer = None
+    if jobs <= 1 and not dry_run:
+        # The renderer reports the time it took to load the map with its first entry.
+        renderer = LegendRenderer(legend, map_xml, base_path, images_dir, tmp_dir, cache)
+        planning_map = renderer.map
+        layer_styles = renderer.layer_styles
     else:
-        m.background = mapnik.Color(background_color)
-    layer_styles = LayerStyles(m.layers, kwargs["tmp_dir"])
-    writer = writer_class(legend["width"], template)
+        with timed(run_timings, "map_load"):
+            # The map is loaded as the renderer would load it. It is stripped of its datasources only if
+            # requested because that requires parsing the style with ElementTree.
+            planning_map = load_map(map_xml, base_path, legend["width"], legend["height"])
+            layer_styles = LayerStyles(planning_map.layers)
+    zoom_analysis = None
+    if (skip_identical_zooms or verify_skipped_zooms) and zoom is None:
+        zoom_analysis = ZoomAnalysis(planning_map, layer_styles, legend.get("extra_tags"))
+    verify_skipped_zooms = verify_skipped_zooms and zoom_analysis is not None
+    with timed(run_timings, "planning"):
+        plan = plan_legend(legend, layer_styles, zoom, zoom_analysis, verify_skipped_zooms)
+    if dry_run:
+        return plan
 
-    for idx, feature in enumerate(legend["features"], start=0):
-        z = feature.get("zoom")
-        min_zoom = feature.get("min_zoom")
-        max_zoom = feature.get("max_zoom")
-        if z is not None and (min_zoom is not None or max_zoom is not None):
-            raise MapnikLegendaryError("Conflicting zoom specification for {}. Sepcify either zoom only or both min_zoom and max_zoom.".format(feature.get("name")))
-        if z is None and min_zoom is None and max_zoom is None:
-            raise MapnikLegendaryError("Incomplete zoom specification for feature {}.".format(feature.get("name")))
-        if min_zoom is None and max_zoom is None:
-            min_zoom = int(z)
-            max_zoom = int(z)
-        if min_zoom is not None:
-            min_zoom = int(min_zoom)
-        else:
-            min_zoom = 0
-        if max_zoom is not None:
-            max_zoom = int(max_zoom)
-        else:
-            max_zoom = 24
-        if min_zoom > max_zoom:
-            raise MapnikLegendaryError("min_zoom is larger than max_zoom for feature {}".format(feature.get("name")))
-        properties = feature.get("properties", {})
-        if not isinstance(properties, dict):
-            raise MapnikLegendaryError("properties of feature {} is not a key-value mapping but {}".format(
-                feature.get("name"), type(properties)
-            ))
-        for zoom_this in range(min_zoom, max_zoom + 1):
-            f = Feature(feature, zoom_this, m, legend["extra_tags"])
-            if zoom_this != zoom and zoom is not None:
-                logger.debug("Skipping {} because it is on zoom level {} but {} was requested.".format(f.name, z, zoom))
-                continue
-            # Special height or width for this item
-            m.height = feature.get("image", {}).get("height", default_height)
-            m.width = feature.get("image", {}).get("width", default_width)
-            legend_entry = generate_legend_item(m, layer_styles, f, zoom_this, background_color, properties, images_dir)
-            writer.append(legend_entry)
-    output_file.write(writer.write())
-    output_file.flush()
-    layer_styles.cleanup()
+    # Render stage
+    writer = writer_class(legend["width"], template, **kwargs.get("writer_options", {}))
+    output = LegendOutput(
+        writer, output_file, images_dir, cache_stats, profile, kwargs.get("dedupe_images", False),
+        make_sprite_packer(kwargs), plan.zoom_group_start if verify_skipped_zooms else None,
+        kwargs.get("write_threads", 0)
+    )
+    tasks = plan.tasks
+
+    if renderer is None:
+        entries = render_parallel([ (0, task) for task in tasks ], jobs, {0: (map_xml, base_path)}, {0: (0, legend, images_dir)}, tmp_dir, cache)
+    else:
+        entries = (renderer.render(task) for task in tasks)
+    try:
+        for task, legend_entry in zip(tasks, entries):
+            output.add(task, legend_entry)
+        output.finish()
+    except BaseException:
+        output.abort()
+        raise
+    finally:
+        if renderer is not None:
+            renderer.cleanup()
+    if profile is not None:
+        profile.write(profile_report_file)
+    if cache is not None:
+        cache_size = cache.evict()
+        logger.info("Render cache: {}, {} bytes in cache".format(cache_stats, cache_size))
     # PDF output intentionally dropped
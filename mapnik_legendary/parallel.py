@@ -0,0 +1,64 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import tempfile
+from .renderer import RendererSet
+
+# Renderers of the current worker process, set up by init_worker()
+_renderers = None
+
+
+def init_worker(styles, legends, tmp_dir, cache):
+    """Set up the renderers of a worker process. Every map style is loaded once on first use.
+
+    Every worker gets its own subdirectory of tmp_dir because the names of the temporary files
+    are derived from the layer names only.
+    """
+    global _renderers
+    if tmp_dir is not None:
+        tmp_dir = tempfile.mkdtemp(prefix="worker-{}-".format(os.getpid()), dir=tmp_dir)
+    _renderers = RendererSet(styles, legends, tmp_dir, cache)
+    # Pool workers do not run atexit handlers but they run multiprocessing finalizers if the pool
+    # is closed and joined.
+    multiprocessing.util.Finalize(None, cleanup_worker, args=(tmp_dir,), exitpriority=10)
+
+
+def cleanup_worker(tmp_dir):
+    _renderers.cleanup()
+    if tmp_dir is not None:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def render_task(item):
+    legend_key, task = item
+    return _renderers.render(legend_key, task)
+
+
+def render_parallel(items, jobs, styles, legends, tmp_dir, cache=None):
+    """Render legend items in a pool of worker processes.
+
+    Args:
+        items (list): tuples (legend key, RenderTask) to render
+        jobs (int): number of worker processes
+        styles (dict): tuples (content of the Mapnik XML style, base path of the style) by style key
+        legends (dict): tuples (style key, parsed legend file, images directory) by legend key
+        tmp_dir (str): directory for temporary files or None to build datasources in memory
+        cache (RenderCache): cache of rendered images shared by all workers or None
+
+    Returns:
+        Generator of LegendEntry in the order of the items
+    """
+    pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(styles, legends, tmp_dir, cache))
+    try:
+        for legend_entry in pool.imap(render_task, items):
+            yield legend_entry
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
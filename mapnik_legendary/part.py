@@ -15,13 +15,13 @@ class Part:
         et = extra_tags
         if not et:
             et = []
-        result = { k: None for k in extra_tags }
-        result.update(tags)
+        result = { k: None for k in et }
+        result.update(t)
         return result
 
     def __init__(self, h, zoom, m, extra_tags, name):
         self.tags = Part.merge_tags(h.get('tags'), extra_tags)
-        self.geom = Geometry(h.get('type'), zoom, m)
+        self.geom = Geometry.get(h.get('type'), zoom, m)
         try:
             if "layer" in h:
                 self.layers = [h["layer"]]
@@ -38,15 +38,26 @@ class Part:
         writer.writerow(self.tags)
         return strio.getvalue()
 
-    def to_geojson(self):
-        geom = self.geom.to_geojson()
-        gjs = {
+    def geojson_feature(self):
+        return {
             "type": "Feature",
             "geometry": self.geom.to_geojson(),
             "properties": { k:v for k,v in self.tags.items() }
         }
+
+    def to_geojson_feature(self):
+        # The geometry is serialized once and shared by all parts using it.
+        return '{{"type": "Feature", "geometry": {}, "properties": {}}}'.format(
+            self.geom.to_geojson_string(), json.dumps(self.tags)
+        )
+
+    def datasource_key(self):
+        """Return a key which is equal for all parts resulting in the same datasource."""
+        return (self.geom.key, json.dumps(self.tags, sort_keys=True))
+
+    def to_geojson(self):
         feature_collection = {
             "type": "FeatureCollection",
-            "features": [gjs]
+            "features": [self.geojson_feature()]
         }
         return json.dumps(feature_collection)
@@ -0,0 +1,243 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import logging
+from .exceptions import MapnikLegendaryError
+from .feature import layer_names
+from .geometry import GEOMETRY_TYPES
+from .image_encoding import check_image_format
+from .image_utils import background_rgba
+from .render_task import RenderTask
+from .renderer import legend_scale_factors
+
+
+def zoom_range(feature):
+    """Return the first and the last zoom level of a feature definition."""
+    z = feature.get("zoom")
+    min_zoom = feature.get("min_zoom")
+    max_zoom = feature.get("max_zoom")
+    if z is not None and (min_zoom is not None or max_zoom is not None):
+        raise MapnikLegendaryError("Conflicting zoom specification for {}. Sepcify either zoom only or both min_zoom and max_zoom.".format(feature.get("name")))
+    if z is None and min_zoom is None and max_zoom is None:
+        raise MapnikLegendaryError("Incomplete zoom specification for feature {}.".format(feature.get("name")))
+    if min_zoom is None and max_zoom is None:
+        min_zoom = int(z)
+        max_zoom = int(z)
+    if min_zoom is not None:
+        min_zoom = int(min_zoom)
+    else:
+        min_zoom = 0
+    if max_zoom is not None:
+        max_zoom = int(max_zoom)
+    else:
+        max_zoom = 24
+    if min_zoom > max_zoom:
+        raise MapnikLegendaryError("min_zoom is larger than max_zoom for feature {}".format(feature.get("name")))
+    return min_zoom, max_zoom
+
+
+def build_tasks(legend, zoom=None, zoom_analysis=None, verify_skipped_zooms=False):
+    """Expand the features of a legend into render tasks.
+
+    Args:
+        legend (dict): parsed legend file
+        zoom (int): render this zoom level only (defaults to None)
+        zoom_analysis (ZoomAnalysis): render only one zoom level of each range of zoom levels looking the same
+        verify_skipped_zooms (bool): render all zoom levels although a zoom analysis is given
+
+    Returns:
+        Tuple (list of RenderTask, first zoom level of the range expected to look the same by
+        (feature index, zoom level))
+    """
+    logger = logging.getLogger("mapnik-legendary")
+    tasks = []
+    zoom_group_start = {}
+    for idx, feature in enumerate(legend["features"], start=0):
+        min_zoom, max_zoom = zoom_range(feature)
+        properties = feature.get("properties", {})
+        if not isinstance(properties, dict):
+            raise MapnikLegendaryError("properties of feature {} is not a key-value mapping but {}".format(
+                feature.get("name"), type(properties)
+            ))
+        if zoom_analysis is not None:
+            zoom_groups = zoom_analysis.zoom_groups(feature, min_zoom, max_zoom)
+            for group_min, group_max in zoom_groups:
+                if verify_skipped_zooms:
+                    for zoom_this in range(group_min, group_max + 1):
+                        zoom_group_start[(idx, zoom_this)] = group_min
+                        tasks.append(RenderTask(idx, feature, zoom_this, properties))
+                else:
+                    tasks.append(RenderTask(idx, feature, group_min, properties, group_min, group_max))
+            continue
+        for zoom_this in range(min_zoom, max_zoom + 1):
+            if zoom_this != zoom and zoom is not None:
+                logger.debug("Skipping {} because it is on zoom level {} but {} was requested.".format(feature.get("name"), zoom_this, zoom))
+                continue
+            tasks.append(RenderTask(idx, feature, zoom_this, properties))
+    return tasks, zoom_group_start
+
+
+def is_integer(value):
+    """Return true if a value of the legend file is an integer. YAML booleans are not accepted."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_color(value):
+    """Return true if a value of the legend file is a background color supported by background_rgba()."""
+    if not isinstance(value, str):
+        return False
+    try:
+        background_rgba(value)
+    except (MapnikLegendaryError, ValueError):
+        return False
+    return True
+
+
+def validate_feature(feature, idx):
+    """Check the definition of a feature of the legend file.
+
+    Args:
+        feature (dict): definition of the feature
+        idx (int): position of the feature in the legend file
+
+    Returns:
+        list of str: errors
+    """
+    if not isinstance(feature, dict):
+        return ["Feature {} is not a key-value mapping.".format(idx)]
+    errors = []
+    name = feature.get("name")
+    if name is None:
+        errors.append("Feature {} has no name.".format(idx))
+        name = "#{}".format(idx)
+    try:
+        zoom_range(feature)
+    except (MapnikLegendaryError, TypeError, ValueError) as e:
+        errors.append(str(e))
+    if not isinstance(feature.get("properties", {}), dict):
+        errors.append("properties of feature {} is not a key-value mapping but {}".format(name, type(feature["properties"])))
+    image = feature.get("image", {})
+    if not isinstance(image, dict) or not all(is_integer(image.get(k, 0)) for k in ["width", "height"]):
+        errors.append("image of feature {} has to be a key-value mapping with integer width and height.".format(name))
+    parts = feature.get("parts", [feature])
+    if not isinstance(parts, list) or len(parts) == 0:
+        return errors + ["parts of feature {} is not a non-empty list.".format(name)]
+    for part in parts:
+        if not isinstance(part, dict):
+            errors.append("A part of feature {} is not a key-value mapping.".format(name))
+            continue
+        if part.get("type") not in GEOMETRY_TYPES:
+            errors.append("Geometry type {} of feature {} is not supported for legend entries.".format(part.get("type"), name))
+        if "layer" not in part and not isinstance(part.get("layers"), list):
+            errors.append("Key \"layers\" or \"layer\" missing in specification of feature/part {}".format(name))
+        if not isinstance(part.get("tags") or {}, dict):
+            errors.append("tags of feature/part {} is not a key-value mapping but {}".format(name, type(part["tags"])))
+    return errors
+
+
+def validate_legend(legend):
+    """Check a parsed legend file before anything is rendered.
+
+    All errors are collected and reported at once. The layers are checked against the map style
+    by plan_legend() later.
+
+    Args:
+        legend (dict): parsed legend file
+
+    Raises:
+        MapnikLegendaryError: if the legend file contains errors
+    """
+    if not isinstance(legend, dict):
+        raise MapnikLegendaryError("The legend definition is not a key-value mapping.")
+    errors = []
+    for key in ["width", "height"]:
+        if not is_integer(legend.get(key)):
+            errors.append("{} not specified in legend definition or not an integer".format(key))
+    try:
+        legend_scale_factors(legend)
+    except MapnikLegendaryError as e:
+        errors.append(str(e))
+    if "image_format" in legend:
+        try:
+            check_image_format(str(legend["image_format"]))
+        except MapnikLegendaryError as e:
+            errors.append(str(e))
+    if not is_color(legend.get("background", "transparent")):
+        errors.append("Background color {} is not supported. Use transparent, #RRGGBB or #RRGGBBAA.".format(legend["background"]))
+    extra_tags = legend.get("extra_tags") or []
+    if not isinstance(extra_tags, list) or not all(isinstance(k, str) for k in extra_tags):
+        errors.append("extra_tags of the legend definition is not a list of tag keys.")
+    if not isinstance(legend.get("features"), list):
+        errors.append("features of the legend definition is not a list.")
+    else:
+        for idx, feature in enumerate(legend["features"]):
+            errors.extend(validate_feature(feature, idx))
+    if errors:
+        raise MapnikLegendaryError("Invalid legend definition:\n{}".format("\n".join(errors)))
+
+
+def missing_layers(legend, layer_styles):
+    """Return warnings about layers used by the features of a validated legend file which the map style does not contain."""
+    warnings = []
+    for idx, feature in enumerate(legend["features"]):
+        for layer_name in layer_names(feature):
+            if len(layer_styles.get_styles(layer_name)) == 0:
+                warnings.append("Can't find layer {} of feature {} in the Mapnik xml file.".format(layer_name, feature.get("name", "#{}".format(idx))))
+    return warnings
+
+
+class RenderPlan:
+    """Flat list of the render tasks of a legend with their estimated costs."""
+    def __init__(self, legend, tasks, zoom_group_start=None, warnings=None):
+        """
+        Args:
+            legend (dict): parsed legend file
+            tasks (list of RenderTask): tasks in the order of the output
+            zoom_group_start (dict): see build_tasks()
+            warnings (list of str): problems found by missing_layers() which do not prevent rendering
+        """
+        self.legend = legend
+        self.tasks = tasks
+        self.zoom_group_start = zoom_group_start if zoom_group_start is not None else {}
+        self.warnings = warnings if warnings is not None else []
+        # The number of pixels grows with the square of the scale factor.
+        self.pixel_factor = sum(s * s for s in legend_scale_factors(legend))
+
+    def task_cost(self, task):
+        return self.pixel_factor * task.cost(self.legend["width"], self.legend["height"])
+
+    def cost(self):
+        """Estimated cost of rendering all tasks."""
+        return sum(self.task_cost(task) for task in self.tasks)
+
+    def write(self, output_file):
+        """Write a human readable listing of the plan."""
+        for task in self.tasks:
+            zooms = str(task.zoom)
+            if task.minzoom != task.maxzoom:
+                zooms = "{}-{}".format(task.minzoom, task.maxzoom)
+            output_file.write("{}\t{}\tzoom {}\t{}\tcost {}\n".format(
+                task.index, task.feature.get("name"), zooms, ",".join(layer_names(task.feature)), self.task_cost(task)
+            ))
+        output_file.write("{} tasks, total cost {}\n".format(len(self.tasks), self.cost()))
+        output_file.flush()
+
+
+def plan_legend(legend, layer_styles=None, zoom=None, zoom_analysis=None, verify_skipped_zooms=False):
+    """Expand a legend file into a render plan.
+
+    Args:
+        legend (dict): parsed legend file, checked by validate_legend() before
+        layer_styles (LayerStyles): styles of the map, layers are not checked if it is None
+        zoom, zoom_analysis, verify_skipped_zooms: see build_tasks()
+
+    Returns:
+        RenderPlan
+    """
+    logger = logging.getLogger("mapnik-legendary")
+    warnings = []
+    if layer_styles is not None:
+        warnings = missing_layers(legend, layer_styles)
+    for warning in warnings:
+        logger.warn(warning)
+    tasks, zoom_group_start = build_tasks(legend, zoom, zoom_analysis, verify_skipped_zooms)
+    return RenderPlan(legend, tasks, zoom_group_start, warnings)
@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import contextlib
+import json
+import math
+import time
+
+# Stages recorded on an entry which belong to the whole run, e.g. loading the map style in a worker
+# process is recorded on the first entry the worker renders.
+RUN_STAGES = ["map_load"]
+
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    """Add the time spent in the body of the with statement to timings[stage]."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    """Return the p-th percentile (nearest rank) of a sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class ProfileReport:
+    """Collect the timings recorded on legend entries and aggregate them into a report."""
+    def __init__(self, slowest_count=10):
+        """
+        Args:
+            slowest_count (int): number of features to list in the slowest features section
+        """
+        self.slowest_count = slowest_count
+        self.entries = []
+        self.run_timings = {}
+        self.start = time.perf_counter()
+
+    def add_entry(self, task, legend_entry):
+        """Record the timings of a rendered legend entry."""
+        timings = dict(legend_entry.timings)
+        for stage in RUN_STAGES:
+            if stage in timings:
+                self.run_timings[stage] = self.run_timings.get(stage, 0.0) + timings.pop(stage)
+        self.entries.append({
+            "feature": task.feature.get("name"),
+            "index": task.index,
+            "zoom": task.zoom,
+            "minzoom": task.minzoom,
+            "maxzoom": task.maxzoom,
+            "layers": legend_entry.layers,
+            "cache_hit": legend_entry.cache_hit,
+            "timings": timings,
+            "total": sum(timings.values()),
+        })
+
+    def stage_summary(self):
+        values = {}
+        for entry in self.entries:
+            for stage, seconds in entry["timings"].items():
+                values.setdefault(stage, []).append(seconds)
+        values["entry_total"] = [ e["total"] for e in self.entries ]
+        summary = {}
+        for stage, stage_values in values.items():
+            stage_values.sort()
+            summary[stage] = {
+                "count": len(stage_values),
+                "total": sum(stage_values),
+                "p50": percentile(stage_values, 50),
+                "p95": percentile(stage_values, 95),
+                "max": stage_values[-1] if stage_values else 0.0,
+            }
+        return summary
+
+    def slowest_features(self):
+        features = {}
+        for entry in self.entries:
+            f = features.setdefault(entry["index"], {"feature": entry["feature"], "index": entry["index"], "total": 0.0, "entries": 0, "layers": []})
+            f["total"] += entry["total"]
+            f["entries"] += 1
+            for layer in entry["layers"]:
+                if layer not in f["layers"]:
+                    f["layers"].append(layer)
+        return sorted(features.values(), key=lambda f: f["total"], reverse=True)[:self.slowest_count]
+
+    def as_dict(self):
+        return {
+            "total": time.perf_counter() - self.start,
+            "run": self.run_timings,
+            "stages": self.stage_summary(),
+            "slowest_features": self.slowest_features(),
+            "entries": self.entries,
+        }
+
+    def write(self, output_file):
+        json.dump(self.as_dict(), output_file, indent=2)
+        output_file.write("\n")
+        output_file.flush()
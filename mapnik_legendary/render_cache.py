@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import hashlib
+import json
+import logging
+import mapnik
+import os
+import struct
+import tempfile
+import zlib
+from .feature import layer_names
+from .image_encoding import DEFAULT_IMAGE_FORMAT
+from .legend_image import LegendImage
+
+# Increase if the cache file format or the rendering pipeline changes in a way which makes cached
+# images invalid.
+CACHE_VERSION = 3
+
+
+def render_key(feature, zoom, width, height, background_color, layer_styles, scale_factor=1, image_format=DEFAULT_IMAGE_FORMAT, settings=None):
+    """Build a hash of everything affecting the image of a legend item.
+
+    Args:
+        feature (dict): definition of the feature in the legend file
+        zoom (int): zoom level
+        width (int): image width
+        height (int): image height
+        background_color (str): background color as specified in the legend file
+        layer_styles (LayerStyles): layer styles with XML of the styles and hashes of the files read by them loaded
+        scale_factor (float): scale factor the image is rendered at
+        image_format (str): format string the image is encoded with
+        settings (dict): other settings of the legend file affecting the image, e.g. extra_tags
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([CACHE_VERSION, mapnik.mapnik_version(), feature, zoom, width, height, background_color, scale_factor, image_format, settings], sort_keys=True, default=str).encode("utf-8"))
+    h.update(layer_styles.map_settings.encode("utf-8"))
+    h.update(json.dumps(layer_styles.file_hashes.get(None, [])).encode("utf-8"))
+    for layer_name in layer_names(feature):
+        h.update(layer_name.encode("utf-8"))
+        for style_xml in layer_styles.get_style_xml(layer_name):
+            h.update(style_xml.encode("utf-8"))
+        h.update(json.dumps(layer_styles.get_file_hashes(layer_name)).encode("utf-8"))
+    return h.hexdigest()
+
+
+class CacheStats:
+    """Counters of a render cache summed up over all legend entries of a run."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def count(self, legend_entry):
+        """Add the cache usage recorded on a legend entry by generate_legend_item."""
+        if legend_entry.cache_hit is None:
+            return
+        if legend_entry.cache_hit:
+            self.hits += 1
+            self.bytes_read += legend_entry.cache_bytes
+        else:
+            self.misses += 1
+            self.bytes_written += legend_entry.cache_bytes
+
+    def __str__(self):
+        return "{} hits, {} misses, {} bytes read, {} bytes written".format(self.hits, self.misses, self.bytes_read, self.bytes_written)
+
+
+class RenderCache:
+    """Content-addressed on-disk cache of rendered legend images.
+
+    The cache key is a hash of everything affecting the image: the definition of the feature in
+    the legend file, the zoom level, the image size, the scale factor, the background color, the
+    image format, the other rendering settings of the legend file, the attributes and FontSets of
+    the map style, the XML of all styles of the layers used by the feature and the content of the
+    files read by these styles (symbols, patterns, fonts). Instances can be sent to worker
+    processes. Writes are atomic, therefore several processes can use the same directory.
+    """
+
+    logger = logging.getLogger("mapnik-legendary")
+    header = struct.Struct("<4sIII")
+    magic = b"MLC1"
+
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory (str): cache directory
+            max_bytes (int): maximum size of the cache, enforced by evict()
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, feature, zoom, width, height, background_color, layer_styles, scale_factor=1, image_format=DEFAULT_IMAGE_FORMAT, settings=None):
+        """Build the cache key of a legend item, see render_key()."""
+        return render_key(feature, zoom, width, height, background_color, layer_styles, scale_factor, image_format, settings)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, image_format):
+        """Look up a cached image.
+
+        Returns:
+            Tuple (LegendImage, size of the cache file) or None if the key is not in the cache
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                content = cache_file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        if len(content) < RenderCache.header.size:
+            return None
+        magic, width, height, encoded_length = RenderCache.header.unpack_from(content)
+        if magic != RenderCache.magic:
+            return None
+        offset = RenderCache.header.size
+        encoded = content[offset:offset + encoded_length]
+        try:
+            data = zlib.decompress(content[offset + encoded_length:])
+        except zlib.error:
+            self.logger.warn("Ignoring corrupt cache file {}".format(path))
+            return None
+        return LegendImage(width, height, data, image_format, encoded=encoded), len(content)
+
+    def put(self, key, legend_image):
+        """Store an image in the cache.
+
+        Returns:
+            int: size of the cache file
+        """
+        encoded = legend_image.encode()
+        content = RenderCache.header.pack(RenderCache.magic, legend_image.width, legend_image.height, len(encoded)) \
+            + encoded + zlib.compress(legend_image.data)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return len(content)
+
+    def evict(self):
+        """Remove the least recently used images until the cache is not larger than its maximum size.
+
+        Returns:
+            int: size of the cache after eviction
+        """
+        files = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        files.sort()
+        for mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
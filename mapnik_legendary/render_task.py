@@ -0,0 +1,28 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from .feature import layer_names
+
+
+class RenderTask:
+    """A single legend item to be rendered: one feature of the legend file on one zoom level."""
+    def __init__(self, index, feature, zoom, properties, minzoom=None, maxzoom=None):
+        """
+        Args:
+            index (int): position of the feature in the legend file
+            feature (dict): definition of the feature as read from the legend file
+            zoom (int): zoom level to render
+            properties (dict): properties of the legend entry
+            minzoom (int): first zoom level the rendered image is valid for (defaults to zoom)
+            maxzoom (int): last zoom level the rendered image is valid for (defaults to zoom)
+        """
+        self.index = index
+        self.feature = feature
+        self.zoom = zoom
+        self.properties = properties
+        self.minzoom = zoom if minzoom is None else minzoom
+        self.maxzoom = zoom if maxzoom is None else maxzoom
+
+    def cost(self, default_width, default_height):
+        """Estimate the relative cost of rendering this task: number of pixels times number of layers."""
+        image = self.feature.get("image", {})
+        pixels = image.get("width", default_width) * image.get("height", default_height)
+        return pixels * max(1, len(layer_names(self.feature)))
@@ -0,0 +1,251 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import logging
+import mapnik
+import re
+import time
+from .feature import Feature
+from .image_encoding import check_image_format, DEFAULT_IMAGE_FORMAT
+from .exceptions import MapnikLegendaryError
+from .layer_styles import LayerStyles
+from .profiling import timed
+from .legend_image import LegendImage
+from .legend_entry import clean_name, LegendEntry
+
+
+IMAGE_FORMAT = DEFAULT_IMAGE_FORMAT
+# Settings of the legend file affecting the images which are not passed to generate_legend_item() separately
+RENDER_SETTINGS = ["extra_tags", "fonts_dir"]
+# Font directories registered with Mapnik by this process
+_registered_font_dirs = set()
+SRS = "+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0.0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs +over"
+
+
+def generate_legend_item(mapnik_map, layer_styles, feature, zoom_level, background_color, properties, images_dir, idx=0, cache=None, scale_factors=(1,), image_format=IMAGE_FORMAT, settings=None):
+    """Render a legend item into memory.
+
+    The image is not written to disk. Call LegendEntry.write_image() if it is needed. If a render
+    cache is given and contains the item, Mapnik is not used at all.
+
+    Args:
+        scale_factors (list): scale factors to render the item at, has to contain 1. The image at
+            scale factor 1 becomes LegendEntry.rendered, the others LegendEntry.variants.
+        image_format (str): format string the images are encoded with, see check_image_format()
+        settings (dict): settings of the legend file listed in RENDER_SETTINGS, part of the cache key
+
+    Returns:
+        LegendEntry: the rendered legend entry
+    """
+    logger = logging.getLogger("mapnik-legendary")
+    fid = feature.name
+    if not fid:
+        fid = "legend-{}".format(idx)
+    fid = clean_name(fid)
+    legend_entry = LegendEntry(fid, feature.description, zoom_level, properties, images_dir)
+
+    legend_entry.layers = [ l for part in feature.parts if part for l in part.layers ]
+
+    images = {}
+    cache_keys = {}
+    if cache is not None:
+        with timed(legend_entry.timings, "cache_lookup"):
+            for scale_factor in scale_factors:
+                cache_keys[scale_factor] = cache.key(feature.definition, zoom_level, mapnik_map.width, mapnik_map.height, background_color, layer_styles, scale_factor, image_format, settings)
+                cached = cache.get(cache_keys[scale_factor], image_format)
+                if cached is not None:
+                    images[scale_factor], size = cached
+                    legend_entry.cache_bytes += size
+        legend_entry.cache_hit = len(images) == len(scale_factors)
+        if legend_entry.cache_hit:
+            logger.info("Using cached image of feature {} on zoom level {}".format(feature.name, zoom_level))
+
+    missing = [ s for s in scale_factors if s not in images ]
+    if missing:
+        logger.info("Rendering feature {} on zoom level {}".format(feature.name, zoom_level))
+        with timed(legend_entry.timings, "prepare_layer"):
+            layer_styles.attach_layers(mapnik_map, feature.parts)
+
+        # The layers are prepared once for all scale factors. A larger image showing the same
+        # envelope is rendered with the scale factor passed to Mapnik. Mapnik multiplies the scale
+        # denominator by the scale factor, therefore the same rules apply as at scale factor 1.
+        width = mapnik_map.width
+        height = mapnik_map.height
+        try:
+            for scale_factor in missing:
+                mapnik_map.width = int(round(width * scale_factor))
+                mapnik_map.height = int(round(height * scale_factor))
+                with timed(legend_entry.timings, "zoom_to_box"):
+                    mapnik_map.zoom_to_box(feature.envelope())
+                image = mapnik.Image(mapnik_map.width, mapnik_map.height)
+                try:
+                    with timed(legend_entry.timings, "render"):
+                        mapnik.render(mapnik_map, image, scale_factor)
+                except Exception as e:
+                    r = r"^CSV Plugin: no attribute '([^']+)'"
+                    match_data = re.match(r, str(e))
+                    if match_data:
+                        raise MapnikLegendaryError("{} is a key needed for feature \"{}\" on zoom level {}. Try adding {} to the extra_tags list.\n".format(match_data.group(1), feature.name, zoom_level, match_data.group(1)))
+                    else:
+                        raise e
+                images[scale_factor] = LegendImage.from_mapnik(image, image_format)
+                if cache is not None:
+                    with timed(legend_entry.timings, "cache_store"):
+                        legend_entry.cache_bytes += cache.put(cache_keys[scale_factor], images[scale_factor])
+        finally:
+            mapnik_map.width = width
+            mapnik_map.height = height
+
+    legend_entry.rendered = images[1]
+    legend_entry.variants = { s: images[s] for s in scale_factors if s != 1 }
+
+    with timed(legend_entry.timings, "image_only_background"):
+        empty = [ s for s in scale_factors if images[s].only_background(background_color) ]
+    if 1 in empty:
+        logger.warn("Feature \"{}\" on zoom {} not rendered, legend image is empty.".format(feature.name, zoom_level))
+    elif empty:
+        logger.warn("Feature \"{}\" on zoom {} not rendered at scale factor {}, legend image is empty.".format(
+            feature.name, zoom_level, ", ".join("{:g}".format(s) for s in empty)
+        ))
+    return legend_entry
+
+
+def register_fonts(fonts_dir):
+    """Register the fonts in a directory with Mapnik unless this has been done before by this process."""
+    if fonts_dir not in _registered_font_dirs:
+        mapnik.FontEngine.register_fonts(fonts_dir)
+        _registered_font_dirs.add(fonts_dir)
+
+
+def legend_scale_factors(legend):
+    """Return the sorted scale factors requested by a legend file. Scale factor 1 is always included."""
+    scale_factors = legend.get("scale_factors", [1])
+    if not isinstance(scale_factors, list):
+        scale_factors = [scale_factors]
+    for s in scale_factors:
+        if isinstance(s, bool) or not isinstance(s, (int, float)) or s <= 0:
+            raise MapnikLegendaryError("Invalid scale factor {} in legend definition, scale factors have to be positive numbers.".format(s))
+    return sorted(set([1] + scale_factors))
+
+
+def load_map(map_xml, base_path, width, height):
+    """Load a Mapnik XML style into a new map."""
+    m = mapnik.Map(width, height, SRS)
+    mapnik.load_map_from_string(m, map_xml.encode("utf-8"), False, base_path)
+    m.width = width
+    m.height = height
+    return m
+
+
+class LegendRenderer:
+    """Mapnik map loaded from a style together with everything needed to render legend items with it.
+
+    Instances are not shared between processes. Every worker process builds its own one.
+    """
+    def __init__(self, legend, map_xml, base_path, images_dir, tmp_dir, cache=None):
+        """
+        Args:
+            legend (dict): parsed legend file
+            map_xml (str): content of the Mapnik XML style
+            base_path (str): directory relative paths in the Mapnik XML style are resolved against
+            images_dir (str): directory to write the images to
+            tmp_dir (str): directory for temporary files or None to build datasources in memory
+            cache (RenderCache): cache of rendered images or None
+        """
+        if "width" not in legend or "height" not in legend:
+            raise MapnikLegendaryError("width or height not specified in legend definition")
+        start = time.perf_counter()
+        self.map = load_map(map_xml, base_path, legend["width"], legend["height"])
+        # Reported with the first rendered entry because the renderer may live in a worker process.
+        self.map_load_time = time.perf_counter() - start
+        self.configure(legend, images_dir)
+        self.layer_styles = LayerStyles(self.map.layers, tmp_dir)
+        self.cache = cache
+        if cache is not None:
+            self.layer_styles.read_style_xml(self.map)
+
+    def configure(self, legend, images_dir):
+        """Apply the settings of a legend file. A renderer can be used for several legends of the same style."""
+        if "width" not in legend or "height" not in legend:
+            raise MapnikLegendaryError("width or height not specified in legend definition")
+        if "fonts_dir" in legend:
+            register_fonts(legend["fonts_dir"])
+        self.default_width = legend["width"]
+        self.default_height = legend["height"]
+        self.extra_tags = legend.get("extra_tags")
+        self.settings = { k: legend.get(k) for k in RENDER_SETTINGS }
+        self.images_dir = images_dir
+        self.scale_factors = legend_scale_factors(legend)
+        self.image_format = legend.get("image_format", IMAGE_FORMAT)
+        check_image_format(self.image_format)
+        self.background_color = legend.get("background", "transparent")
+        if self.background_color == "transparent":
+            self.map.background = mapnik.Color(255, 255, 255, 0)
+        else:
+            self.map.background = mapnik.Color(self.background_color)
+
+    def render(self, task):
+        """Render a legend item.
+
+        Args:
+            task (RenderTask): item to render
+
+        Returns:
+            LegendEntry: the rendered legend entry
+        """
+        # Special height or width for this item. It has to be set before the geometry is built
+        # because the geometry depends on the image size.
+        self.map.height = task.feature.get("image", {}).get("height", self.default_height)
+        self.map.width = task.feature.get("image", {}).get("width", self.default_width)
+        start = time.perf_counter()
+        f = Feature(task.feature, task.zoom, self.map, self.extra_tags)
+        feature_time = time.perf_counter() - start
+        legend_entry = generate_legend_item(self.map, self.layer_styles, f, task.zoom, self.background_color, task.properties, self.images_dir, task.index, self.cache, self.scale_factors, self.image_format, self.settings)
+        legend_entry.minzoom = task.minzoom
+        legend_entry.maxzoom = task.maxzoom
+        legend_entry.timings["feature"] = feature_time
+        if self.map_load_time is not None:
+            legend_entry.timings["map_load"] = self.map_load_time
+            self.map_load_time = None
+        return legend_entry
+
+    def cleanup(self):
+        self.layer_styles.cleanup()
+
+
+class RendererSet:
+    """Renderers for several legends and map styles. Every map style is loaded only once."""
+    def __init__(self, styles, legends, tmp_dir, cache=None):
+        """
+        Args:
+            styles (dict): tuples (content of the Mapnik XML style, base path of the style) by style key
+            legends (dict): tuples (style key, parsed legend file, images directory) by legend key
+            tmp_dir (str): directory for temporary files or None to build datasources in memory
+            cache (RenderCache): cache of rendered images or None
+        """
+        self.styles = styles
+        self.legends = legends
+        self.tmp_dir = tmp_dir
+        self.cache = cache
+        self.renderers = {}
+        # Legend key the renderer of a style is configured for
+        self.configured = {}
+
+    def get(self, legend_key):
+        """Return the renderer for a legend, load its map style if necessary."""
+        style_key, legend, images_dir = self.legends[legend_key]
+        renderer = self.renderers.get(style_key)
+        if renderer is None:
+            map_xml, base_path = self.styles[style_key]
+            renderer = LegendRenderer(legend, map_xml, base_path, images_dir, self.tmp_dir, self.cache)
+            self.renderers[style_key] = renderer
+        elif self.configured[style_key] != legend_key:
+            renderer.configure(legend, images_dir)
+        self.configured[style_key] = legend_key
+        return renderer
+
+    def render(self, legend_key, task):
+        return self.get(legend_key).render(task)
+
+    def cleanup(self):
+        for renderer in self.renderers.values():
+            renderer.cleanup()
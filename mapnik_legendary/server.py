@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+from .exceptions import MapnikLegendaryError
+from .image_encoding import media_type
+from .map_xml import included_files, strip_map_xml
+from .plan import is_integer, missing_layers, validate_legend
+from .render_task import RenderTask
+from .renderer import LegendRenderer
+
+
+class RendererCache:
+    """Least recently used cache of loaded map styles.
+
+    Renderers are keyed by the path of the map style and the modification times of the style file
+    and the files included by it. A renderer is loaded again if one of these files changes. The
+    legend settings of a request are applied to the cached renderer. Only map styles below a root
+    directory can be loaded.
+    """
+    def __init__(self, max_size, strip_datasources=False, root=None):
+        """
+        Args:
+            max_size (int): maximum number of loaded map styles
+            strip_datasources (bool): remove the datasources from the map styles before loading them
+            root (str): directory containing the map styles, relative paths are relative to it
+                (default: current working directory)
+        """
+        self.max_size = max_size
+        self.strip_datasources = strip_datasources
+        self.root = os.path.realpath(root or os.getcwd())
+        self.renderers = collections.OrderedDict()
+
+    def resolve(self, map_path):
+        """Return the absolute path of a map style, raise an error if it is outside the root directory."""
+        path = os.path.realpath(os.path.join(self.root, map_path))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise MapnikLegendaryError("Map style {} is outside of the style directory".format(map_path))
+        return path
+
+    def get(self, map_path, legend):
+        """Return a renderer for a map style configured with legend settings, load it if necessary.
+
+        Args:
+            map_path (str): path to the Mapnik XML style
+            legend (dict): legend settings (width, height, background, extra_tags, fonts_dir, ...)
+        """
+        map_path = self.resolve(map_path)
+        mtimes = tuple(os.stat(p).st_mtime_ns for p in [map_path] + sorted(included_files(map_path)))
+        key = (map_path, mtimes)
+        renderer = self.renderers.get(key)
+        if renderer is not None:
+            self.renderers.move_to_end(key)
+            renderer.configure(legend, None)
+            return renderer
+        # Outdated versions of the same style will never be used again.
+        for old_key in [ k for k in self.renderers if k[0] == map_path ]:
+            self.renderers.pop(old_key).cleanup()
+        with open(map_path, "r") as map_file:
+            map_xml = map_file.read()
+        if self.strip_datasources:
+            map_xml = strip_map_xml(map_xml, None, os.path.dirname(map_path))
+        renderer = LegendRenderer(legend, map_xml, os.path.dirname(map_path), None, None)
+        self.renderers[key] = renderer
+        while len(self.renderers) > self.max_size:
+            self.renderers.popitem(last=False)[1].cleanup()
+        return renderer
+
+
+class LegendServer:
+    """HTTP server rendering single legend items.
+
+    A request is a POST request to /render with a JSON object as body:
+
+        {
+            "map": "path/to/style.xml",
+            "legend": {"width": 100, "height": 60, "background": "transparent", "extra_tags": []},
+            "feature": {"name": "motorway", "type": "linestring", "tags": {}, "layers": []},
+            "zoom": 15
+        }
+
+    "map" is relative to the style directory of the RendererCache. "legend" contains the same
+    settings as the top level of a legend file, "feature" one entry of its list of features. The
+    response is the encoded image.
+    """
+
+    logger = logging.getLogger("mapnik-legendary")
+
+    def __init__(self, renderer_cache):
+        self.renderer_cache = renderer_cache
+        # Mapnik maps must not be used by multiple threads. A single thread renders while the event
+        # loop keeps accepting requests.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def render(self, request):
+        """Render a legend item.
+
+        The legend settings and the feature are checked like a legend file before anything is
+        rendered.
+
+        Returns:
+            Tuple (bytes, str): encoded image and its media type
+        """
+        if not isinstance(request, dict):
+            raise MapnikLegendaryError("The request has to be a JSON object")
+        for key in ["map", "legend", "feature", "zoom"]:
+            if key not in request:
+                raise MapnikLegendaryError("Key \"{}\" missing in request".format(key))
+        if not isinstance(request["legend"], dict) or not isinstance(request["feature"], dict):
+            raise MapnikLegendaryError("legend and feature have to be JSON objects")
+        if not is_integer(request["zoom"]):
+            raise MapnikLegendaryError("zoom has to be an integer")
+        # The zoom level of the request replaces the zoom range of the feature.
+        feature = { k: v for k, v in request["feature"].items() if k not in ["zoom", "min_zoom", "max_zoom"] }
+        feature["zoom"] = request["zoom"]
+        legend = dict(request["legend"], features=[feature])
+        validate_legend(legend)
+        renderer = self.renderer_cache.get(request["map"], request["legend"])
+        errors = missing_layers(legend, renderer.layer_styles)
+        if errors:
+            raise MapnikLegendaryError("Invalid feature:\n{}".format("\n".join(errors)))
+        task = RenderTask(0, feature, request["zoom"], {})
+        rendered = renderer.render(task).rendered
+        return rendered.encode(), media_type(rendered.image_format)
+
+    async def respond(self, writer, status, content_type, body):
+        writer.write("HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+            status, content_type, len(body)
+        ).encode("latin-1"))
+        writer.write(body)
+        await writer.drain()
+        writer.close()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                await self.respond(writer, "400 Bad Request", "text/plain", b"Malformed request")
+                return
+            method, path = request_line[0], request_line[1]
+            if path != "/render":
+                await self.respond(writer, "404 Not Found", "text/plain", b"Not found")
+                return
+            if method != "POST":
+                await self.respond(writer, "405 Method Not Allowed", "text/plain", b"Use POST")
+                return
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            try:
+                request = json.loads(body)
+                image, content_type = await asyncio.get_running_loop().run_in_executor(self.executor, self.render, request)
+            except (ValueError, KeyError, TypeError, OSError, MapnikLegendaryError) as err:
+                await self.respond(writer, "400 Bad Request", "text/plain", str(err).encode("utf-8"))
+                return
+            await self.respond(writer, "200 OK", content_type, image)
+        except Exception as err:
+            self.logger.exception("Rendering failed")
+            await self.respond(writer, "500 Internal Server Error", "text/plain", str(err).encode("utf-8"))
+
+    async def serve(self, host="localhost", port=8080, unix_socket=None):
+        """Serve requests until the task is cancelled.
+
+        Args:
+            host (str): address to listen on
+            port (int): port to listen on
+            unix_socket (str): path of a Unix socket to listen on instead of host and port
+        """
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            self.logger.info("Listening on {}".format(unix_socket))
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+            self.logger.info("Listening on {}:{}".format(host, port))
+        async with server:
+            await server.serve_forever()
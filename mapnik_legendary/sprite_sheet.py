@@ -0,0 +1,173 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import math
+import os.path
+from PIL import Image
+from .exceptions import MapnikLegendaryError
+from .image_encoding import DEFAULT_IMAGE_FORMAT, file_extension
+from .legend_entry import scale_suffix
+from .legend_image import LegendImage
+
+
+class SpriteSheet:
+    """A single image containing many legend images.
+
+    The sheets of scale factors other than 1 use the layout of scale factor 1 with all positions
+    multiplied by the scale factor and rounded. The sheets are encoded in the format of the images
+    they contain.
+    """
+    def __init__(self, name, scale_factors=(1,), image_format=DEFAULT_IMAGE_FORMAT):
+        """
+        Args:
+            name (str): base name of the sheet without extension
+            scale_factors (list): scale factors to write a sheet for
+            image_format (str): format string the sheets are encoded with, see check_image_format()
+        """
+        self.name = name
+        self.scale_factors = scale_factors
+        self.image_format = image_format
+        self.width = 0
+        self.height = 0
+        # List of tuples (LegendEntry, x, y), positions at scale factor 1
+        self.placements = []
+
+    def file_name(self, scale_factor=1):
+        return "{}{}.{}".format(self.name, scale_suffix(scale_factor), file_extension(self.image_format))
+
+    def position(self, x, y, scale_factor=1):
+        """Return the position of an image in the sheet of a scale factor."""
+        return (int(round(x * scale_factor)), int(round(y * scale_factor)))
+
+    def save(self, path, scale_factor=1):
+        """Write the sheet of a scale factor and return the size of the file."""
+        width = int(math.ceil(self.width * scale_factor))
+        height = int(math.ceil(self.height * scale_factor))
+        for legend_entry, x, y in self.placements:
+            rendered = legend_entry.image_for(scale_factor)
+            left, top = self.position(x, y, scale_factor)
+            width = max(width, left + rendered.width)
+            height = max(height, top + rendered.height)
+        sheet = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for legend_entry, x, y in self.placements:
+            sheet.paste(legend_entry.image_for(scale_factor).pil_image(), self.position(x, y, scale_factor))
+        image = LegendImage(width, height, sheet.tobytes(), self.image_format)
+        image.save(path)
+        return len(image.encode())
+
+
+class SpritePacker:
+    """Pack the images of legend entries into sprite sheets.
+
+    The images are packed into shelves: rows of images sorted by height. Equal images are stored
+    only once. Entries with images at several scale factors get one set of sheets per scale factor.
+    """
+    def __init__(self, max_width=1024, max_height=4096, padding=1, name="sprite"):
+        """
+        Args:
+            max_width (int): maximum width of a sprite sheet
+            max_height (int): maximum height of a sprite sheet, a new sheet is started if it is exceeded
+            padding (int): space between the images
+            name (str): base name of the sprite sheet files
+        """
+        self.max_width = max_width
+        self.max_height = max_height
+        self.padding = padding
+        self.name = name
+
+    def cell_size(self, legend_entry):
+        """Return the space an image occupies in the layout of scale factor 1.
+
+        With fractional scale factors, rounding the scaled positions may move an image by up to
+        one pixel. The cell is enlarged until the scaled images cannot overlap their neighbours.
+        """
+        width = legend_entry.rendered.width
+        height = legend_entry.rendered.height
+        for scale_factor in legend_entry.scale_factors():
+            image = legend_entry.image_for(scale_factor)
+            slack = 0 if float(scale_factor).is_integer() else 1
+            width = max(width, int(math.ceil((image.width + slack) / scale_factor - self.padding)))
+            height = max(height, int(math.ceil((image.height + slack) / scale_factor - self.padding)))
+        return width, height
+
+    def pack(self, legend_entries):
+        """Assign a position in a sprite sheet to the image of every legend entry.
+
+        Sets the attribute sprite of every entry.
+
+        Returns:
+            list of SpriteSheet
+        """
+        def digest(legend_entry):
+            return tuple(legend_entry.image_for(s).digest() for s in legend_entry.scale_factors())
+
+        images = {}
+        scale_factors = set()
+        image_formats = set()
+        for legend_entry in legend_entries:
+            images.setdefault(digest(legend_entry), legend_entry)
+            scale_factors.update(legend_entry.scale_factors())
+            image_formats.add(legend_entry.rendered.image_format)
+        scale_factors = sorted(scale_factors)
+        for legend_entry in images.values():
+            if legend_entry.scale_factors() != scale_factors:
+                raise MapnikLegendaryError("All images in a sprite sheet have to be rendered at the same scale factors.")
+            rendered = legend_entry.rendered
+            if rendered.width > self.max_width or rendered.height > self.max_height:
+                raise MapnikLegendaryError("Image of size {}x{} does not fit into a sprite sheet of {}x{}.".format(
+                    rendered.width, rendered.height, self.max_width, self.max_height
+                ))
+        if len(image_formats) > 1:
+            raise MapnikLegendaryError("All images in a sprite sheet have to use the same image format.")
+        image_format = image_formats.pop() if image_formats else DEFAULT_IMAGE_FORMAT
+        cells = { key: self.cell_size(legend_entry) for key, legend_entry in images.items() }
+        sheets = []
+        positions = {}
+        sheet = None
+        x = 0
+        y = 0
+        shelf_height = 0
+        for key, legend_entry in sorted(images.items(), key=lambda i: (-cells[i[0]][1], -cells[i[0]][0], i[0])):
+            width, height = cells[key]
+            if sheet is not None and x + width > self.max_width:
+                # Start a new shelf
+                x = 0
+                y += shelf_height + self.padding
+                shelf_height = 0
+            if sheet is None or y + height > self.max_height:
+                sheet = SpriteSheet("{}-{}".format(self.name, len(sheets)), scale_factors, image_format)
+                sheets.append(sheet)
+                x = 0
+                y = 0
+                shelf_height = 0
+            sheet.placements.append((legend_entry, x, y))
+            positions[key] = (sheet, x, y)
+            sheet.width = max(sheet.width, x + width)
+            sheet.height = max(sheet.height, y + height)
+            shelf_height = max(shelf_height, height)
+            x += width + self.padding
+        for legend_entry in legend_entries:
+            sheet, x, y = positions[digest(legend_entry)]
+            legend_entry.sprite = {
+                "sheet": sheet.file_name(),
+                "sheets": { s: sheet.file_name(s) for s in scale_factors },
+                "sheet_width": sheet.width,
+                "sheet_height": sheet.height,
+                "x": x,
+                "y": y,
+                "width": legend_entry.rendered.width,
+                "height": legend_entry.rendered.height,
+            }
+        return sheets
+
+    def write(self, legend_entries, images_directory):
+        """Pack the images of the entries and write the sprite sheets to a directory.
+
+        The size of the sheet file is reported as size of the image of every entry in it.
+        """
+        sizes = {}
+        for sheet in self.pack(legend_entries):
+            for scale_factor in sheet.scale_factors:
+                file_name = sheet.file_name(scale_factor)
+                sizes[file_name] = sheet.save(os.path.join(images_directory, file_name), scale_factor)
+        for legend_entry in legend_entries:
+            legend_entry.image_sizes = { s: sizes[legend_entry.image_name(s)] for s in legend_entry.scale_factors() }
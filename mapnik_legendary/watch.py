@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import copy
+import hashlib
+import json
+import logging
+import mapnik
+import os
+import tempfile
+import time
+import yaml
+from .feature import layer_names
+from .legend_output import LegendOutput
+from .map_xml import included_files, referenced_files, strip_map_xml
+from .mapnik_legendary import make_cache, make_sprite_packer
+from .plan import plan_legend, validate_legend
+from .render_cache import CacheStats, render_key
+from .renderer import IMAGE_FORMAT, legend_scale_factors, LegendRenderer
+
+
+def file_state(paths):
+    """Return the modification times of files by path, None for missing files."""
+    state = {}
+    for path in paths:
+        try:
+            state[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            state[path] = None
+    return state
+
+
+def changed_layers(old_layer_styles, new_layer_styles):
+    """Return the names of the layers whose styles or the files read by them differ between two loaded versions of a map style."""
+    names = set(old_layer_styles.styles_by_layer) | set(new_layer_styles.styles_by_layer)
+    return sorted(
+        l for l in names
+        if old_layer_styles.get_style_xml(l) != new_layer_styles.get_style_xml(l)
+        or old_layer_styles.get_file_hashes(l) != new_layer_styles.get_file_hashes(l)
+    )
+
+
+class LegendWatcher:
+    """Render a legend again whenever the legend file, the map style or a file included by it changes.
+
+    Only entries whose feature definition, legend settings, layers, styles or the files read by
+    the styles (symbols, patterns, fonts) changed are rendered again. All other entries are taken from the previous run. The output file is replaced
+    atomically.
+    """
+
+    logger = logging.getLogger("mapnik-legendary")
+
+    def __init__(self, legend_path, map_path, output_path, writer_class, **kwargs):
+        """
+        Args:
+            legend_path (str): path of the legend file
+            map_path (str): path of the Mapnik XML style
+            output_path (str): path of the output file
+            writer_class (class): class implementing the output format
+
+        Keyword Args:
+            template, zoom, images_directory, tmp_dir, cache_dir, cache_size, strip_datasources,
+            dedupe_images, sprites, sprite_max_width, sprite_max_height, writer_options,
+            image_format, write_threads: as for generate_legend
+        """
+        self.legend_path = legend_path
+        self.map_path = os.path.abspath(map_path)
+        self.output_path = output_path
+        self.writer_class = writer_class
+        self.options = kwargs
+        self.images_dir = kwargs.get("images_directory") or os.path.dirname(os.path.abspath(output_path))
+        self.cache = make_cache(kwargs)
+        self.renderer = None
+        self.map_state = None
+        self.state = None
+        # Layers kept by strip_map_xml when the map was loaded, None if all layers were kept
+        self.loaded_layers = None
+        # Files read by the styles by style name, see referenced_files()
+        self.style_files = {}
+        # Entries of the last run by signature
+        self.entries = {}
+
+    def map_files(self):
+        """Return the style file, the files included by it and the files read by its styles."""
+        referenced = set()
+        for paths in self.style_files.values():
+            referenced |= paths
+        return [self.map_path] + sorted(included_files(self.map_path)) + sorted(referenced)
+
+    def watched_files(self):
+        return [self.legend_path] + self.map_files()
+
+    def used_layers(self, legend):
+        return { l for feature in legend["features"] for l in layer_names(feature) }
+
+    def load_map(self, legend):
+        """Load the map style and report the layers whose styles changed."""
+        base_path = os.path.dirname(self.map_path)
+        with open(self.map_path, "r") as map_file:
+            map_xml = map_file.read()
+        self.style_files = referenced_files(map_xml, base_path)
+        self.loaded_layers = None
+        if self.options.get("strip_datasources", False):
+            self.loaded_layers = self.used_layers(legend)
+            map_xml = strip_map_xml(map_xml, self.loaded_layers, base_path)
+        # Mapnik caches symbols by path. Changed files have to be read again.
+        if hasattr(mapnik, "clear_cache"):
+            mapnik.clear_cache()
+        renderer = LegendRenderer(legend, map_xml, os.path.dirname(self.map_path), self.images_dir, self.options.get("tmp_dir"), self.cache)
+        if not renderer.layer_styles.style_xml:
+            renderer.layer_styles.read_style_xml(renderer.map)
+        if self.renderer is not None:
+            changed = changed_layers(self.renderer.layer_styles, renderer.layer_styles)
+            self.logger.info("Styles of {} layers changed: {}".format(len(changed), ", ".join(changed)))
+            self.renderer.cleanup()
+        self.renderer = renderer
+
+    def signature(self, legend, task):
+        """Return a hash of everything affecting the entry of a task.
+
+        The render key covers the content of the files read by the styles. They are hashed when
+        the map is loaded, which happens whenever one of them changes.
+        """
+        image = task.feature.get("image", {})
+        # Extending the zoom range of a feature does not change the entries of its other zoom levels.
+        feature = { k: v for k, v in task.feature.items() if k not in ["zoom", "min_zoom", "max_zoom"] }
+        key = render_key(
+            feature, task.zoom, image.get("width", legend["width"]), image.get("height", legend["height"]),
+            legend.get("background", "transparent"), self.renderer.layer_styles, legend_scale_factors(legend),
+            legend.get("image_format", IMAGE_FORMAT), self.renderer.settings
+        )
+        settings = { k: v for k, v in legend.items() if k != "features" }
+        # The position in the legend file is only used to name the images of features without a name.
+        index = None if task.feature.get("name") else task.index
+        h = hashlib.sha256(key.encode("utf-8"))
+        h.update(json.dumps([settings, index, task.properties], sort_keys=True, default=str).encode("utf-8"))
+        return h.hexdigest()
+
+    def run(self):
+        """Render the legend, reuse all entries which did not change since the last run."""
+        start = time.perf_counter()
+        with open(self.legend_path, "r") as legend_file:
+            legend = yaml.safe_load(legend_file)
+        if isinstance(legend, dict) and self.options.get("image_format") is not None:
+            legend["image_format"] = self.options["image_format"]
+        validate_legend(legend)
+        map_state = file_state(self.map_files())
+        # A stripped map lacks the layers which were not used when it was loaded.
+        missing_layers = self.loaded_layers is not None and not self.used_layers(legend) <= self.loaded_layers
+        if self.renderer is None or map_state != self.map_state or missing_layers:
+            self.load_map(legend)
+            self.map_state = file_state(self.map_files())
+        else:
+            self.renderer.configure(legend, self.images_dir)
+        plan = plan_legend(legend, self.renderer.layer_styles, self.options.get("zoom"))
+
+        writer = self.writer_class(legend["width"], self.options.get("template"), **self.options.get("writer_options", {}))
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        tmp_file = tempfile.NamedTemporaryFile("w", dir=output_dir, prefix=".tmp-", delete=False)
+        entries = {}
+        rendered = 0
+        output = None
+        try:
+            output = LegendOutput(
+                writer, tmp_file, self.images_dir, CacheStats(), None, self.options.get("dedupe_images", False),
+                make_sprite_packer(self.options), None, self.options.get("write_threads", 0)
+            )
+            for task in plan.tasks:
+                signature = self.signature(legend, task)
+                previous = self.entries.get(signature)
+                if previous is None:
+                    legend_entry = self.renderer.render(task)
+                    rendered += 1
+                else:
+                    # The writer may have changed the zoom range of the previous entry while merging.
+                    legend_entry = copy.copy(previous)
+                    legend_entry.minzoom = task.minzoom
+                    legend_entry.maxzoom = task.maxzoom
+                    legend_entry.timings = {}
+                    legend_entry.cache_hit = None
+                entries[signature] = legend_entry
+                output.add(task, legend_entry)
+            output.finish()
+            tmp_file.close()
+            # Temporary files are only readable by their owner.
+            os.chmod(tmp_file.name, 0o644)
+            os.replace(tmp_file.name, self.output_path)
+        except BaseException:
+            if output is not None:
+                output.abort()
+            tmp_file.close()
+            os.remove(tmp_file.name)
+            raise
+        self.entries = entries
+        self.logger.info("Rendered {} of {} entries in {:.2f} s".format(rendered, len(plan.tasks), time.perf_counter() - start))
+
+    def watch(self, interval=0.5):
+        """Render the legend whenever a watched file changes. Runs until interrupted."""
+        try:
+            while True:
+                state = file_state(self.watched_files())
+                if state != self.state:
+                    self.state = state
+                    try:
+                        self.run()
+                    except Exception:
+                        self.logger.exception("Rendering the legend failed, waiting for the next change")
+                time.sleep(interval)
+        finally:
+            if self.renderer is not None:
+                self.renderer.cleanup()
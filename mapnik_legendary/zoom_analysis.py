@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import mapnik
+from .feature import Feature
+
+# Scale denominator of zoom level 0 in Web Mercator with the standard pixel size of 0.28 mm
+SCALE_DENOMINATOR_Z0 = 559082264.0287178
+# Tolerance Mapnik uses when checking if a rule is active
+SCALE_EPSILON = 1e-6
+
+
+def scale_denominator(zoom):
+    """Return the scale denominator Mapnik uses when rendering a legend item on the given zoom level."""
+    return SCALE_DENOMINATOR_Z0 / 2**zoom
+
+
+class ZoomAnalysis:
+    """Find ranges of zoom levels on which a legend item looks the same.
+
+    The geometry of a legend item is scaled with the zoom level in a way that it always covers the
+    same pixels. Symbolizer sizes are given in pixels. Therefore a legend item looks the same on
+    all zoom levels which select the same rules of the styles of its layers. Rules are selected by
+    their filter and their minimum and maximum scale denominator. The filters are evaluated on the
+    parts of the feature once, the scale denominators on every zoom level. Rules whose filter does
+    not match any part do not split the range of zoom levels.
+    """
+    def __init__(self, mapnik_map, layer_styles, extra_tags=None):
+        """
+        Args:
+            mapnik_map (mapnik.Map): map the styles are loaded into
+            layer_styles (LayerStyles): mapping from layer names to style names of the map
+            extra_tags (list): extra_tags of the legend file, set to null on every part
+        """
+        self.map = mapnik_map
+        self.layer_styles = layer_styles
+        self.extra_tags = extra_tags
+        self.rules = {}
+
+    def get_rules(self, style_name):
+        """Get minimum and maximum scale denominators and the filter of all rules of a style."""
+        if style_name not in self.rules:
+            style = self.map.find_style(style_name)
+            self.rules[style_name] = [ (r.min_scale, r.max_scale, r.filter) for r in style.rules ]
+        return self.rules[style_name]
+
+    def matching_rules(self, feature):
+        """Return the scale denominator ranges of the rules whose filter matches a part of a feature.
+
+        Args:
+            feature (dict): definition of the feature in the legend file
+
+        Returns:
+            List of tuples (minimum scale denominator, maximum scale denominator)
+        """
+        # The geometry type of a part does not depend on the zoom level.
+        f = Feature(feature, 0, self.map, self.extra_tags)
+        context = mapnik.Context()
+        scales = []
+        for part in f.parts:
+            mapnik_feature = mapnik.Feature.from_geojson(part.to_geojson_feature(), context)
+            for layer_name in part.layers:
+                for style_name in self.layer_styles.get_styles(layer_name):
+                    scales.extend(
+                        (min_scale, max_scale) for min_scale, max_scale, rule_filter in self.get_rules(style_name)
+                        if rule_filter.to_bool(mapnik_feature)
+                    )
+        return scales
+
+    def signature(self, scales, zoom):
+        """Return which of the given rules are active on a zoom level.
+
+        Args:
+            scales (list): scale denominator ranges of the rules, see matching_rules()
+            zoom (int): zoom level
+        """
+        denominator = scale_denominator(zoom)
+        return tuple(
+            min_scale - SCALE_EPSILON <= denominator < max_scale + SCALE_EPSILON
+            for min_scale, max_scale in scales
+        )
+
+    def zoom_groups(self, feature, min_zoom, max_zoom):
+        """Split a range of zoom levels into ranges of zoom levels on which the feature looks the same.
+
+        Args:
+            feature (dict): definition of the feature in the legend file
+            min_zoom (int): first zoom level of the range
+            max_zoom (int): last zoom level of the range
+
+        Returns:
+            List of tuples (first zoom level, last zoom level)
+        """
+        scales = self.matching_rules(feature)
+        groups = []
+        last_signature = None
+        for zoom in range(min_zoom, max_zoom + 1):
+            signature = self.signature(scales, zoom)
+            if groups and signature == last_signature:
+                groups[-1] = (groups[-1][0], zoom)
+            else:
+                groups.append((zoom, zoom))
+            last_signature = signature
+        return groups
@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import importlib
+import importlib.util
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Dependencies of all tests. The tests are skipped if one of them is not installed.
+REQUIRED_MODULES = ["geojson", "jinja2", "yaml", "PIL"]
+# Tests of modules importing mapnik, see mapnik_available()
+MAPNIK_TESTS = [
+    "test_geometry.py",
+    "test_legend.py",
+    "test_plan.py",
+    "test_render_cache.py",
+    "test_server.py",
+    "test_watch.py",
+    "test_writers.py",
+    "test_zoom_analysis.py",
+]
+
+
+def mapnik_available():
+    """Return true if the Python bindings of Mapnik 3.x the code is written for are installed."""
+    if importlib.util.find_spec("mapnik") is None:
+        return False
+    # The bindings of Mapnik 4 changed the API (e.g. Envelope and mapnik_version() were removed).
+    return hasattr(importlib.import_module("mapnik"), "mapnik_version")
+
+
+collect_ignore = []
+collect_ignore_glob = []
+if any(importlib.util.find_spec(m) is None for m in REQUIRED_MODULES):
+    collect_ignore_glob.append("test_*.py")
+elif not mapnik_available():
+    collect_ignore.extend(MAPNIK_TESTS)
@@ -0,0 +1,57 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import json
+import pytest
+from mapnik_legendary import geometry
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.feature import Feature
+from mapnik_legendary.geometry import Geometry
+from mapnik_legendary.renderer import SRS
+
+
+class Map:
+    """Stand-in for the attributes of mapnik.Map a geometry depends on."""
+    def __init__(self, width, height, srs=SRS):
+        self.width = width
+        self.height = height
+        self.srs = srs
+
+
+def test_geometry_covers_the_image():
+    g = Geometry.get("polygon", 0, Map(256, 128))
+    assert g.max_x == pytest.approx(40075016.69, rel=1e-6)
+    assert g.max_y == pytest.approx(g.max_x / 2)
+    # One zoom level more halves the extent, the image shows the same pixels.
+    assert Geometry.get("polygon", 1, Map(256, 128)).max_x == pytest.approx(g.max_x / 2)
+    assert json.loads(g.to_geojson_string())["type"] == "Polygon"
+    with pytest.raises(MapnikLegendaryError):
+        Geometry("circle", 0, Map(256, 128))
+
+
+def test_geometries_are_shared():
+    m = Map(100, 60)
+    assert Geometry.get("linestring", 14, m) is Geometry.get("linestring", 14, Map(100, 60))
+    assert Geometry.get("linestring", 14, m) is not Geometry.get("linestring", 15, m)
+    assert Geometry.get("linestring", 14, m) is not Geometry.get("linestring", 14, Map(100, 61))
+    feature = Feature({"name": "road", "parts": [
+        {"type": "linestring", "tags": {"highway": "primary"}, "layers": ["roads"]},
+        {"type": "linestring", "tags": {"highway": "primary"}, "layers": ["roads-casing"]},
+        {"type": "linestring", "tags": {"highway": "secondary"}, "layers": ["roads"]},
+    ]}, 14, m, ["ref"])
+    assert all(part.geom is Geometry.get("linestring", 14, m) for part in feature.parts)
+    assert feature.parts[0].datasource_key() == feature.parts[1].datasource_key()
+    assert feature.parts[0].datasource_key() != feature.parts[2].datasource_key()
+    assert feature.parts[0].tags == {"ref": None, "highway": "primary"}
+
+
+def test_least_recently_used_geometries_are_dropped(monkeypatch):
+    monkeypatch.setattr(geometry, "MAX_GEOMETRIES", 3)
+    monkeypatch.setattr(geometry, "_geometries", geometry.collections.OrderedDict())
+    first = Geometry.get("point", 10, Map(10, 10))
+    for size in range(11, 14):
+        Geometry.get("point", 10, Map(size, size))
+        # The first geometry is used again and therefore kept.
+        assert Geometry.get("point", 10, Map(10, 10)) is first
+    assert len(geometry._geometries) == 3
+    assert ("point", 10, 11, 11, SRS) not in geometry._geometries
+    assert ("point", 10, 13, 13, SRS) in geometry._geometries
@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import pytest
+from PIL import Image
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.image_encoding import check_image_format, file_extension, format_name, optimize_png, pillow_options, split_format
+
+
+def test_format_name():
+    assert format_name("png8:c=64") == "png"
+    assert format_name("png256:t=2") == "png"
+    assert format_name("jpeg80") == "jpeg"
+    assert format_name("webp:quality=80") == "webp"
+    assert file_extension("jpeg80") == "jpg"
+
+
+def test_split_format():
+    assert split_format("png8:c=64") == ("png8:c=64", False)
+    assert split_format("png8:c=64:optimize") == ("png8:c=64", True)
+    assert split_format("png8:optimize:t=2") == ("png8:t=2", True)
+    assert split_format("optimize") == ("optimize", False)
+
+
+def test_pillow_options():
+    assert pillow_options("webp") == {}
+    assert pillow_options("webp:quality=80:method=6") == {"quality": 80, "method": 6}
+    assert pillow_options("avif:q=50") == {"quality": 50}
+    assert pillow_options("webp:lossless") == {"lossless": True}
+    assert pillow_options("webp:lossless=0") == {"lossless": False}
+    with pytest.raises(MapnikLegendaryError):
+        pillow_options("webp:speed=3")
+    with pytest.raises(MapnikLegendaryError):
+        pillow_options("webp:quality=high")
+
+
+def test_check_image_format():
+    check_image_format("png256:t=2")
+    check_image_format("jpeg80")
+    for image_format in ["bmp", "", "webp:quality=high", "webp:foo"]:
+        with pytest.raises(MapnikLegendaryError):
+            check_image_format(image_format)
+
+
+def test_optimize_png_is_lossless():
+    image = Image.new("RGBA", (32, 32), (0, 0, 0, 0))
+    for i in range(32):
+        image.putpixel((i, i), (255, 0, 0, 255))
+    output = io.BytesIO()
+    image.save(output, "PNG", compress_level=0)
+    optimized = optimize_png(output.getvalue())
+    assert len(optimized) <= len(output.getvalue())
+    with Image.open(io.BytesIO(optimized)) as result:
+        assert result.convert("RGBA").tobytes() == image.tobytes()
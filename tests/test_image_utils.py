@@ -0,0 +1,39 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import pytest
+from PIL import Image
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.image_utils import background_rgba, images_equal, rgba_only_background
+
+
+def test_background_rgba():
+    assert background_rgba("transparent") == (255, 255, 255, 0)
+    assert background_rgba("#ff0000") == (255, 0, 0, 255)
+    assert background_rgba("00ff0080") == (0, 255, 0, 128)
+    with pytest.raises(MapnikLegendaryError):
+        background_rgba("#fff")
+
+
+def test_rgba_only_background_transparent():
+    assert rgba_only_background(bytes(4 * 16), "transparent")
+    data = bytearray(4 * 16)
+    data[4 * 7 + 3] = 1
+    assert not rgba_only_background(bytes(data), "transparent")
+
+
+def test_rgba_only_background_opaque():
+    white = b"\xff\xff\xff\xff" * 8
+    assert rgba_only_background(white, "#ffffff")
+    # Fully transparent pixels count as background.
+    assert rgba_only_background(white + bytes(8), "#ffffff")
+    # A semi-transparent pixel cannot have an opaque background color.
+    assert not rgba_only_background(white + b"\xff\xff\xff\x80", "#ffffff")
+
+
+def test_images_equal():
+    image1 = Image.new("RGBA", (4, 3), (10, 20, 30, 255))
+    image2 = Image.new("RGBA", (4, 3), (10, 20, 30, 255))
+    assert images_equal(image1, image2)
+    image2.putpixel((3, 2), (10, 20, 31, 255))
+    assert not images_equal(image1, image2)
+    assert not images_equal(image1, Image.new("RGBA", (3, 4), (10, 20, 30, 255)))
@@ -0,0 +1,215 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import json
+import os
+import pytest
+import yaml
+from PIL import Image
+from mapnik_legendary import generate_legend, JSONWriter
+from mapnik_legendary import mapnik_legendary, renderer
+from mapnik_legendary.batch import run_batch
+from mapnik_legendary.feature import Feature
+from mapnik_legendary.layer_styles import LayerStyles
+from mapnik_legendary.render_task import RenderTask
+from mapnik_legendary.renderer import load_map, LegendRenderer
+
+# The filter contains an unescaped ampersand. Mapnik loads the style but ElementTree refuses to
+# parse it.
+MAP_XML = """<Map>
+  <Style name="roads">
+    <Rule><Filter>[name] = 'A & B'</Filter><LineSymbolizer stroke="#0000ff" stroke-width="2" /></Rule>
+    <Rule><Filter>[highway] = 'primary'</Filter><LineSymbolizer stroke="#ff0000" stroke-width="4" /></Rule>
+    <Rule><Filter>[highway] = 'track'</Filter><LineSymbolizer stroke="#996600" stroke-width="1" /></Rule>
+  </Style>
+  <Style name="points">
+    <Rule><MarkersSymbolizer fill="#00ff00" width="8" height="8" allow-overlap="true" /></Rule>
+  </Style>
+  <Layer name="roads"><StyleName>roads</StyleName></Layer>
+  <Layer name="points"><StyleName>points</StyleName></Layer>
+</Map>
+"""
+
+LEGEND = {
+    "width": 40,
+    "height": 20,
+    "features": [
+        {"name": "primary", "type": "linestring", "tags": {"highway": "primary"}, "layers": ["roads"], "min_zoom": 14, "max_zoom": 15},
+        {"name": "track", "type": "linestring", "tags": {"highway": "track"}, "layers": ["roads"], "min_zoom": 14, "max_zoom": 15},
+        {"name": "stop", "type": "point", "tags": {}, "layers": ["points"], "min_zoom": 14, "max_zoom": 15},
+    ],
+}
+
+
+def run(tmp_path, name, legend=LEGEND, **kwargs):
+    """Render the legend with generate_legend and return the entries with the name and content of their image."""
+    images_dir = tmp_path / name
+    images_dir.mkdir()
+    (tmp_path / "style.xml").write_text(MAP_XML)
+    output = io.StringIO()
+    with open(str(tmp_path / "style.xml"), "r") as map_file:
+        result = generate_legend(
+            io.StringIO(yaml.safe_dump(legend)), map_file, JSONWriter, output_file=output,
+            images_directory=str(images_dir), **kwargs
+        )
+    if kwargs.get("dry_run"):
+        return result
+    return read_entries(output.getvalue())
+
+
+def read_entries(json_output):
+    """Return the entries of JSON output with the name and content of their image."""
+    entries = json.loads(json_output)
+    for entry in entries:
+        with open(entry["image"], "rb") as image_file:
+            entry["image"] = (os.path.basename(entry["image"]), image_file.read())
+    return entries
+
+
+@pytest.fixture
+def no_strip(monkeypatch):
+    """Fail if the style is parsed to strip its datasources."""
+    def strip_map_xml(*args):
+        raise AssertionError("strip_map_xml() called without strip_datasources")
+    monkeypatch.setattr(mapnik_legendary, "strip_map_xml", strip_map_xml)
+
+
+def test_planning_loads_the_style_unchanged(tmp_path, no_strip):
+    assert len(run(tmp_path, "plan", dry_run=True).tasks) == 3 * 2
+    # Entries of adjacent zoom levels which look the same are merged.
+    assert len(run(tmp_path, "parallel", jobs=2)) == 3
+
+
+def test_sprite_sheets_use_the_image_format(tmp_path):
+    entries = run(tmp_path, "sprites", sprites=True, image_format="png8:c=16")
+    assert {e["image"][0] for e in entries} == {"sprite-0.png"}
+    sheet_path = str(tmp_path / "sprites" / "sprite-0.png")
+    with Image.open(sheet_path) as sheet:
+        assert sheet.mode == "P"
+    assert all(e["format"] == "png" and e["bytes"] == os.path.getsize(sheet_path) for e in entries)
+
+
+def test_parallel_output_equals_serial_output(tmp_path):
+    serial = run(tmp_path, "serial")
+    assert [ e["description"] for e in serial ] == ["primary", "track", "stop"]
+    assert run(tmp_path, "parallel", jobs=2) == serial
+
+
+def test_memory_datasources_render_like_geojson_files(tmp_path):
+    (tmp_path / "tmp").mkdir()
+    memory = run(tmp_path, "memory")
+    assert run(tmp_path, "files", tmp_dir=str(tmp_path / "tmp")) == memory
+    # The GeoJSON files are removed at the end.
+    assert os.listdir(str(tmp_path / "tmp")) == []
+    mapnik_map = load_map(MAP_XML, str(tmp_path), 40, 20)
+    layer_styles = LayerStyles(mapnik_map.layers)
+    part = Feature(LEGEND["features"][0], 14, mapnik_map, None).parts[0]
+    datasource = layer_styles.get_datasource(part)
+    assert layer_styles.tmp_files == set()
+    assert datasource.num_features() == 1
+
+
+def test_items_are_rendered_into_memory(tmp_path):
+    # A lossless format to compare the written image with the rendered pixels
+    renderer = LegendRenderer(dict(LEGEND, image_format="png32"), MAP_XML, str(tmp_path), str(tmp_path), None)
+    try:
+        legend_entry = renderer.render(RenderTask(0, LEGEND["features"][0], 14, {}))
+    finally:
+        renderer.cleanup()
+    # Nothing is written until the image is needed.
+    assert os.listdir(str(tmp_path)) == []
+    image = legend_entry.rendered
+    assert (image.width, image.height) == (40, 20)
+    assert len(image.data) == 40 * 20 * 4
+    assert not image.only_background("transparent")
+    legend_entry.write_image()
+    with Image.open(legend_entry.get_image_file_path()) as written:
+        assert written.convert("RGBA").tobytes() == image.data
+    digest = image.digest()
+    legend_entry.release_images()
+    # Released images keep their encoded form and hash.
+    assert image.data is None
+    assert image.digest() == digest
+    assert image.encode() == (tmp_path / os.path.basename(legend_entry.get_image_file_path())).read_bytes()
+
+
+def test_profile_report(tmp_path):
+    report_file = io.StringIO()
+    entries = run(tmp_path, "profile", profile_report=report_file)
+    report = json.loads(report_file.getvalue())
+    assert "map_load" in report["run"]
+    assert {"prepare_layer", "render", "image_only_background", "writer_append", "write_image"} <= set(report["stages"])
+    # One entry per render, also for the ones merged into the previous entry.
+    assert len(report["entries"]) == 3 * 2 > len(entries)
+    assert report["stages"]["render"]["count"] == 3 * 2
+    assert sorted(f["feature"] for f in report["slowest_features"]) == ["primary", "stop", "track"]
+    assert all(e["total"] == pytest.approx(sum(e["timings"].values())) for e in report["entries"])
+
+
+def test_batch_loads_every_style_once(tmp_path, monkeypatch):
+    loaded = []
+    def load_map(*args):
+        loaded.append(args[0])
+        return mapnik_legendary.load_map(*args)
+    monkeypatch.setattr(renderer, "load_map", load_map)
+    points = {"width": 30, "height": 30, "features": LEGEND["features"][2:]}
+    roads = dict(LEGEND, features=LEGEND["features"][:2])
+    for name, legend in [("points", points), ("roads", roads)]:
+        (tmp_path / "{}.yml".format(name)).write_text(yaml.safe_dump(legend))
+        (tmp_path / "{}-images".format(name)).mkdir()
+    (tmp_path / "style.xml").write_text(MAP_XML)
+    (tmp_path / "manifest.yml").write_text(yaml.safe_dump({"jobs": [
+        {"legend": "roads.yml", "map": "style.xml", "output": "roads.json", "format": "json", "images_dir": "roads-images"},
+        {"legend": "points.yml", "map": "style.xml", "output": "points.json", "format": "json", "images_dir": "points-images"},
+    ]}))
+    with open(str(tmp_path / "manifest.yml"), "r") as manifest_file:
+        run_batch(manifest_file)
+    assert len(loaded) == 1
+    # The legends look as if they were rendered one by one.
+    assert read_entries((tmp_path / "roads.json").read_text()) == run(tmp_path, "roads", roads)
+    assert read_entries((tmp_path / "points.json").read_text()) == run(tmp_path, "points", points)
+
+
+def test_scale_factors(tmp_path):
+    entries = run(tmp_path, "hidpi", dict(LEGEND, scale_factors=[2, 1.5]))
+    assert [ e["image"] for e in entries ] == [ e["image"] for e in run(tmp_path, "plain") ]
+    for entry in entries:
+        assert sorted(entry["srcset"]) == ["1.5x", "1x", "2x"]
+        for scale_factor, size in [("1x", (40, 20)), ("1.5x", (60, 30)), ("2x", (80, 40))]:
+            assert os.path.basename(entry["srcset"][scale_factor]) == "{}-14{}.png".format(
+                entry["description"], "" if scale_factor == "1x" else "@" + scale_factor
+            )
+            with Image.open(entry["srcset"][scale_factor]) as image:
+                assert image.size == size
+                # The rules of scale factor 1 apply, the images are not empty.
+                assert image.convert("RGBA").getbbox() is not None
+
+
+def test_layers_are_reused(tmp_path):
+    def render(legend_renderer, feature_index, zoom):
+        return legend_renderer.render(RenderTask(feature_index, LEGEND["features"][feature_index], zoom, {})).rendered
+
+    legend_renderer = LegendRenderer(LEGEND, MAP_XML, str(tmp_path), str(tmp_path), None)
+    prepared = []
+    prepare_layer = legend_renderer.layer_styles.prepare_layer
+    def count_prepared(layer_name, srs, part):
+        prepared.append(layer_name)
+        return prepare_layer(layer_name, srs, part)
+    legend_renderer.layer_styles.prepare_layer = count_prepared
+    try:
+        render(legend_renderer, 0, 14)
+        render(legend_renderer, 0, 15)
+        assert prepared == ["roads"]
+        # Only the datasource of the layer is replaced for other tags.
+        track = render(legend_renderer, 1, 15)
+        assert prepared == ["roads"]
+        render(legend_renderer, 2, 15)
+        assert prepared == ["roads", "points"]
+    finally:
+        legend_renderer.cleanup()
+    fresh_renderer = LegendRenderer(LEGEND, MAP_XML, str(tmp_path), str(tmp_path), None)
+    try:
+        assert render(fresh_renderer, 1, 15).equals(track)
+        assert not render(fresh_renderer, 0, 15).equals(track)
+    finally:
+        fresh_renderer.cleanup()
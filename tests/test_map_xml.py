@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import pytest
+import xml.etree.ElementTree as ET
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.map_xml import included_files, resolve_entities, strip_map_xml
+
+MAP_XML = """<?xml version="1.0" encoding="utf-8"?>
+<Map srs="+init=epsg:3857">
+  <Style name="roads-style"><Rule><LineSymbolizer stroke="#000000" /></Rule></Style>
+  <Style name="water-style"><Rule><PolygonSymbolizer fill="#0000ff" /></Rule></Style>
+  <Style name="orphan-style"><Rule /></Style>
+  <Layer name="roads">
+    <StyleName>roads-style</StyleName>
+    <Datasource><Parameter name="type">postgis</Parameter></Datasource>
+  </Layer>
+  <Layer name="water">
+    <StyleName>water-style</StyleName>
+    <Datasource><Parameter name="type">shape</Parameter></Datasource>
+  </Layer>
+</Map>
+"""
+
+
+def names(root, tag):
+    return sorted(e.get("name") for e in root.iter(tag))
+
+
+def test_strip_datasources():
+    root = ET.fromstring(strip_map_xml(MAP_XML, None))
+    assert list(root.iter("Datasource")) == []
+    assert names(root, "Layer") == ["roads", "water"]
+    assert names(root, "Style") == ["roads-style", "water-style"]
+    assert root.get("srs") == "+init=epsg:3857"
+
+
+def test_strip_unused_layers():
+    root = ET.fromstring(strip_map_xml(MAP_XML, {"roads"}))
+    assert names(root, "Layer") == ["roads"]
+    assert names(root, "Style") == ["roads-style"]
+
+
+def test_external_entities(tmp_path):
+    (tmp_path / "inc").mkdir()
+    (tmp_path / "inc" / "settings.ent").write_text("<!ENTITY srs \"+proj=merc\">")
+    (tmp_path / "inc" / "layers.xml").write_text(
+        "<?xml version=\"1.0\"?>\n<Layer name=\"roads\"><StyleName>roads-style</StyleName>"
+        "<Datasource><Parameter name=\"type\">postgis</Parameter></Datasource></Layer>"
+    )
+    map_xml = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE Map [
+<!ENTITY % settings SYSTEM "inc/settings.ent">
+%settings;
+<!ENTITY layers SYSTEM "inc/layers.xml">
+<!ENTITY color "#ff0000">
+]>
+<Map srs="&srs;">
+  <Style name="roads-style"><Rule><LineSymbolizer stroke="&color;" /></Rule></Style>
+  &layers;
+</Map>
+"""
+    assert "SYSTEM" not in resolve_entities(map_xml, str(tmp_path))
+    root = ET.fromstring(strip_map_xml(map_xml, {"roads"}, str(tmp_path)))
+    assert root.get("srs") == "+proj=merc"
+    assert names(root, "Layer") == ["roads"]
+    assert list(root.iter("Datasource")) == []
+    assert root.find("Style/Rule/LineSymbolizer").get("stroke") == "#ff0000"
+
+
+def test_nested_external_entities(tmp_path):
+    # Paths of entities declared by an included file are relative to that file.
+    (tmp_path / "inc" / "layers").mkdir(parents=True)
+    (tmp_path / "inc" / "entities.ent").write_text(
+        "<!ENTITY % settings SYSTEM \"settings.ent\">\n%settings;\n<!ENTITY layers SYSTEM 'layers/roads.xml'>"
+    )
+    (tmp_path / "inc" / "settings.ent").write_text("<!ENTITY srs \"+proj=merc\">")
+    (tmp_path / "inc" / "layers" / "roads.xml").write_text("<Layer name=\"roads\"><StyleName>roads-style</StyleName></Layer>")
+    map_xml = """<!DOCTYPE Map [
+<!ENTITY % entities SYSTEM "inc/entities.ent">
+%entities;
+]>
+<Map srs="&srs;">
+  <Style name="roads-style"><Rule><LineSymbolizer stroke="#ff0000" /></Rule></Style>
+  &layers;
+</Map>
+"""
+    (tmp_path / "style.xml").write_text(map_xml)
+    root = ET.fromstring(strip_map_xml(map_xml, {"roads"}, str(tmp_path)))
+    assert root.get("srs") == "+proj=merc"
+    assert names(root, "Layer") == ["roads"]
+    assert included_files(str(tmp_path / "style.xml")) == {
+        str(tmp_path / "inc" / "entities.ent"),
+        str(tmp_path / "inc" / "settings.ent"),
+        str(tmp_path / "inc" / "layers" / "roads.xml"),
+    }
+
+
+def test_missing_included_file(tmp_path):
+    map_xml = "<!DOCTYPE Map [<!ENTITY layers SYSTEM \"missing.xml\">]><Map>&layers;</Map>"
+    with pytest.raises(MapnikLegendaryError):
+        strip_map_xml(map_xml, None, str(tmp_path))
+
+
+def test_unparseable_style():
+    with pytest.raises(MapnikLegendaryError):
+        strip_map_xml("<Map>&undefined;</Map>", None)
@@ -0,0 +1,115 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import pytest
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.layer_styles import LayerStyles
+from mapnik_legendary.plan import build_tasks, plan_legend, validate_legend, zoom_range
+
+
+def make_legend(*features, **settings):
+    legend = {"width": 100, "height": 60, "features": list(features)}
+    legend.update(settings)
+    return legend
+
+
+def road(**kwargs):
+    feature = {"name": "road", "type": "linestring", "layers": ["roads"], "tags": {}}
+    feature.update(kwargs)
+    return feature
+
+
+class ZoomGroups:
+    """Zoom analysis stand-in which puts every two zoom levels into one group."""
+    def zoom_groups(self, feature, min_zoom, max_zoom):
+        return [ (z, min(z + 1, max_zoom)) for z in range(min_zoom, max_zoom + 1, 2) ]
+
+
+def test_zoom_range():
+    assert zoom_range({"zoom": 12}) == (12, 12)
+    assert zoom_range({"min_zoom": 10, "max_zoom": 12}) == (10, 12)
+    assert zoom_range({"min_zoom": 10}) == (10, 24)
+    assert zoom_range({"max_zoom": 3}) == (0, 3)
+    with pytest.raises(MapnikLegendaryError):
+        zoom_range({})
+    with pytest.raises(MapnikLegendaryError):
+        zoom_range({"zoom": 12, "min_zoom": 10})
+    with pytest.raises(MapnikLegendaryError):
+        zoom_range({"min_zoom": 12, "max_zoom": 10})
+
+
+def test_validate_legend():
+    validate_legend(make_legend(road(zoom=12)))
+    with pytest.raises(MapnikLegendaryError):
+        validate_legend([])
+
+
+def test_validate_legend_reports_all_errors():
+    legend = make_legend(
+        road(zoom=12, type="circle"),
+        {"type": "point", "layers": ["points"]},
+        road(zoom=12, image={"width": True}),
+        width=True, scale_factors=[2, -1], image_format="bmp",
+    )
+    with pytest.raises(MapnikLegendaryError) as e:
+        validate_legend(legend)
+    message = str(e.value)
+    for error in ["width not specified", "scale factor -1", "bmp", "circle", "Feature 1 has no name", "Incomplete zoom", "integer width and height"]:
+        assert error in message
+
+
+@pytest.mark.parametrize("settings, error", [
+    ({"background": "#abc"}, "Background color #abc"),
+    ({"background": "#zzzzzz"}, "Background color #zzzzzz"),
+    ({"background": 255}, "Background color 255"),
+    ({"extra_tags": "ref"}, "extra_tags"),
+    ({"extra_tags": [{"ref": "A 1"}]}, "extra_tags"),
+])
+def test_validate_legend_settings(settings, error):
+    validate_legend(make_legend(road(zoom=12), background="#f2efe9", extra_tags=["ref"]))
+    with pytest.raises(MapnikLegendaryError) as e:
+        validate_legend(make_legend(road(zoom=12), **settings))
+    assert error in str(e.value)
+
+
+def test_validate_tags():
+    validate_legend(make_legend(road(zoom=12, tags=None), road(zoom=12, parts=[{"type": "point", "layer": "roads"}])))
+    with pytest.raises(MapnikLegendaryError) as e:
+        validate_legend(make_legend(road(zoom=12, tags="feature=kind_0")))
+    assert "tags of feature/part road" in str(e.value)
+    with pytest.raises(MapnikLegendaryError) as e:
+        validate_legend(make_legend(road(zoom=12, parts=[{"type": "point", "layer": "roads", "tags": ["feature"]}])))
+    assert "tags of feature/part road" in str(e.value)
+
+
+def test_build_tasks():
+    legend = make_legend(road(min_zoom=10, max_zoom=12, properties={"a": 1}), road(name="rail", zoom=11))
+    tasks, zoom_group_start = build_tasks(legend)
+    assert [ (t.index, t.zoom) for t in tasks ] == [(0, 10), (0, 11), (0, 12), (1, 11)]
+    assert tasks[0].properties == {"a": 1}
+    assert zoom_group_start == {}
+    tasks, zoom_group_start = build_tasks(legend, zoom=11)
+    assert [ (t.index, t.zoom) for t in tasks ] == [(0, 11), (1, 11)]
+
+
+def test_build_tasks_with_zoom_analysis():
+    legend = make_legend(road(min_zoom=10, max_zoom=12))
+    tasks, zoom_group_start = build_tasks(legend, zoom_analysis=ZoomGroups())
+    assert [ (t.zoom, t.minzoom, t.maxzoom) for t in tasks ] == [(10, 10, 11), (12, 12, 12)]
+    tasks, zoom_group_start = build_tasks(legend, zoom_analysis=ZoomGroups(), verify_skipped_zooms=True)
+    assert [ t.zoom for t in tasks ] == [10, 11, 12]
+    assert zoom_group_start == {(0, 10): 10, (0, 11): 10, (0, 12): 12}
+
+
+def test_plan_legend():
+    layer_styles = LayerStyles([])
+    layer_styles.styles_by_layer = {"roads": ["roads-style"]}
+    legend = make_legend(road(zoom=12), road(name="rail", zoom=12, layers=["rail"]), scale_factors=[2])
+    plan = plan_legend(legend, layer_styles)
+    assert len(plan.tasks) == 2
+    assert plan.warnings == ["Can't find layer rail of feature rail in the Mapnik xml file."]
+    # Scale factors 1 and 2 are rendered, 1 + 4 times the pixels.
+    assert plan.cost() == 2 * 5 * 100 * 60
+    listing = io.StringIO()
+    plan.write(listing)
+    assert listing.getvalue().splitlines()[-1] == "2 tasks, total cost 60000"
@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+from mapnik_legendary.layer_styles import LayerStyles
+from mapnik_legendary.legend_image import LegendImage
+from mapnik_legendary.render_cache import render_key, RenderCache
+from mapnik_legendary.render_task import RenderTask
+from mapnik_legendary.renderer import LegendRenderer
+
+SYMBOL_SVG = "<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"8\" height=\"8\"><rect width=\"8\" height=\"8\" fill=\"{}\" /></svg>"
+SYMBOL_MAP_XML = """<Map>
+  <Style name="shops"><Rule><PointSymbolizer file="symbols/shop.svg" allow-overlap="true" /></Rule></Style>
+  <Layer name="shops"><StyleName>shops</StyleName></Layer>
+</Map>
+"""
+
+
+def make_image(value, size=4):
+    return LegendImage(size, size, bytes([value]) * 4 * size * size, "png", encoded=b"encoded-" + bytes([value]))
+
+
+def make_layer_styles():
+    layer_styles = LayerStyles([])
+    layer_styles.styles_by_layer = {"roads": ["roads-style"]}
+    layer_styles.style_xml = {"roads-style": "<Style name=\"roads-style\" />"}
+    return layer_styles
+
+
+def test_round_trip(tmp_path):
+    cache = RenderCache(str(tmp_path), 1024 * 1024)
+    image = make_image(7)
+    size = cache.put("ab" + "0" * 62, image)
+    assert size > 0
+    cached, cached_size = cache.get("ab" + "0" * 62, "png")
+    assert cached_size == size
+    assert (cached.width, cached.height) == (4, 4)
+    assert cached.data == image.data
+    assert cached.encode() == image.encode()
+    assert cache.get("cd" + "0" * 62, "png") is None
+
+
+def test_corrupt_file_is_ignored(tmp_path):
+    cache = RenderCache(str(tmp_path), 1024 * 1024)
+    key = "ab" + "1" * 62
+    cache.put(key, make_image(1))
+    with open(cache.path(key), "r+b") as cache_file:
+        content = cache_file.read()
+        cache_file.seek(len(content) - 4)
+        cache_file.write(b"xxxx")
+    assert cache.get(key, "png") is None
+    with open(cache.path(key), "wb") as cache_file:
+        cache_file.write(b"MLC")
+    assert cache.get(key, "png") is None
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = RenderCache(str(tmp_path), 0)
+    keys = [ "{:02x}".format(i) + "2" * 62 for i in range(3) ]
+    sizes = [ cache.put(key, make_image(i, 16)) for i, key in enumerate(keys) ]
+    for i, key in enumerate(keys):
+        os.utime(cache.path(key), (1000 + i, 1000 + i))
+    cache.max_bytes = sizes[1] + sizes[2]
+    assert cache.evict() == sizes[1] + sizes[2]
+    assert cache.get(keys[0], "png") is None
+    assert cache.get(keys[1], "png") is not None
+    assert cache.get(keys[2], "png") is not None
+
+
+def test_render_key():
+    layer_styles = make_layer_styles()
+    feature = {"name": "road", "type": "linestring", "layers": ["roads"], "tags": {}}
+    key = render_key(feature, 14, 100, 60, "transparent", layer_styles)
+    assert key == render_key(dict(feature), 14, 100, 60, "transparent", layer_styles)
+    assert key != render_key(feature, 15, 100, 60, "transparent", layer_styles)
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles, 2)
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles, 1, "webp")
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles, settings={"extra_tags": ["ref"]})
+    layer_styles.style_xml["roads-style"] = "<Style name=\"roads-style\"><Rule /></Style>"
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles)
+    layer_styles = make_layer_styles()
+    layer_styles.map_settings = "[('buffer-size', '64')]"
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles)
+    layer_styles = make_layer_styles()
+    layer_styles.file_hashes = {"roads-style": [("/style/symbols/shield.svg", "0" * 64)]}
+    assert key != render_key(feature, 14, 100, 60, "transparent", layer_styles)
+
+
+def test_changed_symbol_is_rendered_again(tmp_path):
+    (tmp_path / "symbols").mkdir()
+    (tmp_path / "symbols" / "shop.svg").write_text(SYMBOL_SVG.format("#ff0000"))
+    feature = {"name": "shop", "type": "point", "layers": ["shops"], "tags": {}, "zoom": 17}
+    legend = {"width": 20, "height": 20, "features": [feature]}
+    cache = RenderCache(str(tmp_path / "cache"), 1024 * 1024)
+
+    def cache_hit():
+        renderer = LegendRenderer(legend, SYMBOL_MAP_XML, str(tmp_path), str(tmp_path), None, cache)
+        try:
+            return renderer.render(RenderTask(0, feature, 17, {})).cache_hit
+        finally:
+            renderer.cleanup()
+
+    assert not cache_hit()
+    assert cache_hit()
+    (tmp_path / "symbols" / "shop.svg").write_text(SYMBOL_SVG.format("#0000ff"))
+    assert not cache_hit()
+    assert cache_hit()
@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import asyncio
+import json
+import os
+import pytest
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.server import LegendServer, RendererCache
+
+MAP_XML = """<Map>
+  <Style name="roads"><Rule><LineSymbolizer stroke="#ff0000" stroke-width="4" /></Rule></Style>
+  <Layer name="roads"><StyleName>roads</StyleName></Layer>
+</Map>
+"""
+
+
+def make_request(**kwargs):
+    request = {
+        "map": "style.xml",
+        "legend": {"width": 40, "height": 20},
+        "feature": {"name": "road", "type": "linestring", "tags": {}, "layers": ["roads"]},
+        "zoom": 15,
+    }
+    request.update(kwargs)
+    return request
+
+
+@pytest.fixture
+def server(tmp_path):
+    (tmp_path / "style.xml").write_text(MAP_XML)
+    return LegendServer(RendererCache(2, root=str(tmp_path)))
+
+
+async def post(server, body):
+    """Send a request to a server listening on a free port and return status line and body of the response."""
+    tcp_server = await asyncio.start_server(server.handle, host="127.0.0.1", port=0)
+    async with tcp_server:
+        port = tcp_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write("POST /render HTTP/1.1\r\nContent-Length: {}\r\n\r\n".format(len(body)).encode("latin-1") + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return head.split(b"\r\n")[0].decode("latin-1"), content
+
+
+def test_render(server):
+    image, content_type = server.render(make_request())
+    assert content_type == "image/png"
+    assert image.startswith(b"\x89PNG")
+
+
+@pytest.mark.parametrize("request_data, error", [
+    (make_request(feature={"name": "road", "type": "linestring", "tags": {}, "layers": "roads"}), "Key \"layers\" or \"layer\" missing"),
+    (make_request(feature={"name": "road", "type": "circle", "tags": "highway=primary", "layers": ["roads"]}), "tags of feature/part road"),
+    (make_request(legend={"width": 40, "height": 20, "background": "#abc"}), "Background color #abc"),
+    (make_request(legend={"height": 20}), "width not specified"),
+    (make_request(feature={"name": "road", "type": "linestring", "layers": ["rail"]}), "Can't find layer rail"),
+    (make_request(zoom="15"), "zoom has to be an integer"),
+])
+def test_invalid_requests(server, request_data, error):
+    with pytest.raises(MapnikLegendaryError) as e:
+        server.render(request_data)
+    assert error in str(e.value)
+
+
+def test_invalid_request_is_rejected(server):
+    status, content = asyncio.run(post(server, json.dumps(make_request(feature={"name": "road", "type": "point", "layers": "roads"})).encode("utf-8")))
+    assert status == "HTTP/1.1 400 Bad Request"
+    assert b"Key \"layers\" or \"layer\" missing" in content
+    status, content = asyncio.run(post(server, json.dumps(make_request()).encode("utf-8")))
+    assert status == "HTTP/1.1 200 OK"
+    assert content.startswith(b"\x89PNG")
+
+
+def test_style_is_loaded_once(server, tmp_path):
+    renderer_cache = server.renderer_cache
+    renderer = renderer_cache.get("style.xml", {"width": 40, "height": 20})
+    for legend in [{"width": 80, "height": 20}, {"width": 40, "height": 20, "scale_factors": [2], "image_format": "png32"}]:
+        assert renderer_cache.get("style.xml", legend) is renderer
+    assert renderer.default_width == 40
+    assert renderer.scale_factors == [1, 2]
+    assert renderer.image_format == "png32"
+    image, content_type = server.render(make_request(legend={"width": 30, "height": 10, "image_format": "webp"}))
+    assert content_type == "image/webp"
+    assert renderer_cache.get("style.xml", {"width": 40, "height": 20}) is renderer
+    # A changed style file is loaded again.
+    os.utime(str(tmp_path / "style.xml"), (1000, 1000))
+    assert renderer_cache.get("style.xml", {"width": 40, "height": 20}) is not renderer
+    assert len(renderer_cache.renderers) == 1
+
+
+def test_style_outside_root(server):
+    with pytest.raises(MapnikLegendaryError):
+        server.renderer_cache.get("../style.xml", {"width": 40, "height": 20})
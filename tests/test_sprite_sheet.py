@@ -0,0 +1,101 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+import pytest
+from PIL import Image
+from mapnik_legendary.exceptions import MapnikLegendaryError
+from mapnik_legendary.legend_entry import LegendEntry
+from mapnik_legendary.legend_image import LegendImage
+from mapnik_legendary.sprite_sheet import SpritePacker
+
+
+def make_entry(name, width, height, value, scale_factors=(1,), image_format="png"):
+    def image(scale_factor):
+        w = int(round(width * scale_factor))
+        h = int(round(height * scale_factor))
+        return LegendImage(w, h, bytes([value]) * 4 * w * h, image_format)
+    legend_entry = LegendEntry(name, name, 10, {}, "images", image(1))
+    legend_entry.variants = { s: image(s) for s in scale_factors if s != 1 }
+    return legend_entry
+
+
+def rectangles(sheet, scale_factor):
+    result = []
+    for legend_entry, x, y in sheet.placements:
+        image = legend_entry.image_for(scale_factor)
+        left, top = sheet.position(x, y, scale_factor)
+        result.append((left, top, left + image.width, top + image.height))
+    return result
+
+
+def overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def test_pack_positions():
+    entries = [ make_entry("e{}".format(i), 10 + i, 5 + i % 3, i) for i in range(20) ]
+    sheets = SpritePacker(max_width=64, max_height=1000).pack(entries)
+    assert len(sheets) == 1
+    rects = rectangles(sheets[0], 1)
+    assert all(r[2] <= sheets[0].width and r[3] <= sheets[0].height for r in rects)
+    assert sheets[0].width <= 64
+    assert not any(overlap(a, b) for i, a in enumerate(rects) for b in rects[i + 1:])
+    for legend_entry in entries:
+        assert legend_entry.sprite["sheet"] == "sprite-0.png"
+        assert (legend_entry.sprite["width"], legend_entry.sprite["height"]) == (legend_entry.rendered.width, legend_entry.rendered.height)
+
+
+def test_equal_images_share_a_position():
+    entries = [make_entry("a", 10, 10, 1), make_entry("b", 10, 10, 2), make_entry("c", 10, 10, 1)]
+    sheets = SpritePacker().pack(entries)
+    assert len(sheets[0].placements) == 2
+    assert (entries[0].sprite["x"], entries[0].sprite["y"]) == (entries[2].sprite["x"], entries[2].sprite["y"])
+    assert (entries[0].sprite["x"], entries[0].sprite["y"]) != (entries[1].sprite["x"], entries[1].sprite["y"])
+
+
+def test_new_sheet_if_full():
+    entries = [ make_entry("e{}".format(i), 30, 30, i) for i in range(4) ]
+    sheets = SpritePacker(max_width=64, max_height=40).pack(entries)
+    assert len(sheets) == 2
+    assert sorted(e.sprite["sheet"] for e in entries) == ["sprite-0.png", "sprite-0.png", "sprite-1.png", "sprite-1.png"]
+
+
+def test_image_too_large():
+    with pytest.raises(MapnikLegendaryError):
+        SpritePacker(max_width=20).pack([make_entry("a", 30, 10, 1)])
+
+
+def test_scale_factors_have_to_match():
+    with pytest.raises(MapnikLegendaryError):
+        SpritePacker().pack([make_entry("a", 10, 10, 1, (1, 2)), make_entry("b", 10, 10, 2)])
+
+
+def test_image_formats_have_to_match():
+    with pytest.raises(MapnikLegendaryError):
+        SpritePacker().pack([make_entry("a", 10, 10, 1), make_entry("b", 10, 10, 2, image_format="webp")])
+
+
+def test_sheets_use_the_image_format(tmp_path):
+    entries = [make_entry("a", 10, 10, 1, (1, 2), "webp:lossless"), make_entry("b", 20, 10, 2, (1, 2), "webp:lossless")]
+    SpritePacker().write(entries, str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == ["sprite-0.webp", "sprite-0@2x.webp"]
+    with Image.open(str(tmp_path / "sprite-0@2x.webp")) as sheet:
+        assert sheet.format == "WEBP"
+        assert sheet.size == (2 * entries[0].sprite["sheet_width"], 2 * entries[0].sprite["sheet_height"])
+    for legend_entry in entries:
+        a = legend_entry.as_dict()
+        assert a["image"] == os.path.join("images", "sprite-0.webp")
+        assert a["format"] == "webp"
+        assert a["bytes"] == os.path.getsize(str(tmp_path / "sprite-0.webp"))
+
+
+@pytest.mark.parametrize("scale_factors", [(1, 2), (1, 1.5), (1, 1.25, 3)])
+@pytest.mark.parametrize("padding", [0, 1])
+def test_scaled_sheets_do_not_overlap(scale_factors, padding):
+    entries = [ make_entry("e{}".format(i), 3 + i * 7 % 31, 3 + i * 5 % 17, i, scale_factors) for i in range(40) ]
+    sheets = SpritePacker(max_width=120, padding=padding).pack(entries)
+    for sheet in sheets:
+        for scale_factor in scale_factors:
+            rects = rectangles(sheet, scale_factor)
+            assert not any(overlap(a, b) for i, a in enumerate(rects) for b in rects[i + 1:])
+    assert entries[0].sprite["sheets"][scale_factors[1]].endswith("@{:g}x.png".format(scale_factors[1]))
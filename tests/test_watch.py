@@ -0,0 +1,69 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import os
+from mapnik_legendary.layer_styles import LayerStyles
+from mapnik_legendary.map_xml import file_hash, included_files, referenced_files
+from mapnik_legendary.watch import changed_layers, file_state
+
+
+def make_layer_styles(style_xml):
+    layer_styles = LayerStyles([])
+    layer_styles.styles_by_layer = {"roads": ["roads-style"], "water": ["water-style"]}
+    layer_styles.style_xml = style_xml
+    return layer_styles
+
+
+def test_included_files(tmp_path):
+    (tmp_path / "inc").mkdir()
+    (tmp_path / "style.xml").write_text(
+        "<!DOCTYPE Map [\n<!ENTITY % settings SYSTEM \"inc/settings.ent\">\n%settings;\n"
+        "<!ENTITY layers SYSTEM 'inc/layers.xml'>\n]>\n<Map>&layers;</Map>"
+    )
+    (tmp_path / "inc" / "settings.ent").write_text("<!ENTITY fonts SYSTEM \"fonts.xml\">")
+    (tmp_path / "inc" / "layers.xml").write_text("<Layer name=\"roads\" />")
+    assert included_files(str(tmp_path / "style.xml")) == {
+        str(tmp_path / "inc" / "settings.ent"),
+        str(tmp_path / "inc" / "layers.xml"),
+        # Relative to the file declaring it, it does not exist.
+        str(tmp_path / "inc" / "fonts.xml"),
+    }
+    assert included_files(str(tmp_path / "missing.xml")) == set()
+
+
+def test_referenced_files(tmp_path):
+    map_xml = """<Map font-directory="fonts">
+  <Style name="shops"><Rule><MarkersSymbolizer file="symbols/shop.svg" /><PointSymbolizer file="symbols/[shop].svg" /></Rule></Style>
+  <Style name="landuse"><Rule><PolygonPatternSymbolizer file="patterns/forest.png" /></Rule></Style>
+  <Style name="roads"><Rule><LineSymbolizer /></Rule></Style>
+</Map>"""
+    files = referenced_files(map_xml, str(tmp_path))
+    assert files == {
+        None: {str(tmp_path / "fonts")},
+        "shops": {str(tmp_path / "symbols" / "shop.svg")},
+        "landuse": {str(tmp_path / "patterns" / "forest.png")},
+        "roads": set(),
+    }
+
+
+def test_changed_layers():
+    old = make_layer_styles({"roads-style": "<Style name=\"roads-style\" />", "water-style": "<Style name=\"water-style\" />"})
+    new = make_layer_styles({"roads-style": "<Style name=\"roads-style\"><Rule /></Style>", "water-style": "<Style name=\"water-style\" />"})
+    assert changed_layers(old, new) == ["roads"]
+    new.styles_by_layer["rail"] = ["rail-style"]
+    assert changed_layers(old, new) == ["rail", "roads"]
+    assert changed_layers(old, old) == []
+
+
+def test_file_state_and_hash(tmp_path):
+    path = tmp_path / "symbol.svg"
+    path.write_text("<svg />")
+    assert file_state([str(path), str(tmp_path / "missing")])[str(tmp_path / "missing")] is None
+    content_hash = file_hash(str(path))
+    os.utime(str(path), (1000, 1000))
+    assert file_hash(str(path)) == content_hash
+    path.write_text("<svg></svg>")
+    assert file_hash(str(path)) != content_hash
+    assert file_hash(str(tmp_path / "missing")) is None
+    directory_hash = file_hash(str(tmp_path))
+    (tmp_path / "font.ttf").write_bytes(b"")
+    assert file_hash(str(tmp_path)) != directory_hash
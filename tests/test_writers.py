@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import json
+import pytest
+from mapnik_legendary.html_writer import HTMLWriter, StreamingHTMLWriter
+from mapnik_legendary.json_writer import JSONWriter, StreamingJSONWriter
+from mapnik_legendary.legend_entry import LegendEntry
+from mapnik_legendary.legend_image import LegendImage
+from mapnik_legendary.legend_output import LegendOutput
+from mapnik_legendary.render_cache import CacheStats
+from mapnik_legendary.render_task import RenderTask
+
+TEMPLATE = "<table>{% for entry in entries %}<tr data-bytes=\"{{ entry.image_bytes() }}\">{{ entry.description }} {{ entry.minzoom }}-{{ entry.maxzoom }}</tr>{% endfor %}</table>"
+
+
+def make_entry(description, zoom, value):
+    image = LegendImage(2, 2, bytes([value]) * 16, "png", encoded=b"png" + bytes([value]))
+    return LegendEntry(description, description, zoom, {}, "images", image)
+
+
+def zoom_ranges(writer_output):
+    return [ (e["description"], e["minzoom"], e["maxzoom"]) for e in json.loads(writer_output) ]
+
+
+def write_all(writer, entries):
+    appended = [ writer.append(e) for e in entries ]
+    return appended, writer.write()
+
+
+def test_merge_adjacent_zoom_levels():
+    entries = [make_entry("road", 10, 1), make_entry("road", 11, 1), make_entry("road", 12, 2), make_entry("road", 13, 2)]
+    appended, output = write_all(JSONWriter(2, None), entries)
+    assert appended == [True, False, True, False]
+    assert zoom_ranges(output) == [("road", 10, 11), ("road", 12, 13)]
+
+
+def test_no_merge_of_different_entries():
+    entries = [make_entry("road", 10, 1), make_entry("rail", 11, 1), make_entry("road", 12, 1)]
+    appended, output = write_all(JSONWriter(2, None), entries)
+    assert appended == [True, True, True]
+    assert zoom_ranges(output) == [("road", 10, 10), ("rail", 11, 11), ("road", 12, 12)]
+
+
+def test_merge_non_adjacent():
+    # Entries rendered at the first zoom level of a range by the zoom analysis follow other features.
+    entries = [make_entry("road", 10, 1), make_entry("rail", 10, 3), make_entry("road", 11, 1), make_entry("road", 13, 1)]
+    appended, output = write_all(JSONWriter(2, None), entries)
+    assert appended == [True, True, True, True]
+    appended, output = write_all(JSONWriter(2, None, merge_non_adjacent=True), entries)
+    assert appended == [True, True, False, True]
+    assert zoom_ranges(output) == [("road", 10, 11), ("rail", 10, 10), ("road", 13, 13)]
+
+
+def render_output(writer, tmp_path, entries, write_threads=0):
+    output_file = io.StringIO()
+    output = LegendOutput(writer, output_file, str(tmp_path), CacheStats(), None, write_threads=write_threads)
+    for legend_entry in entries:
+        output.add(RenderTask(0, {"name": legend_entry.description}, legend_entry.zoom, {}), legend_entry)
+    output.finish()
+    return output_file.getvalue()
+
+
+def make_entries(tmp_path):
+    entries = [make_entry("road", 10, 1), make_entry("road", 11, 1), make_entry("rail", 11, 2), make_entry("rail", 12, 3)]
+    for legend_entry in entries:
+        legend_entry.image_directory = str(tmp_path)
+    return entries
+
+
+@pytest.mark.parametrize("write_threads", [0, 2])
+def test_streaming_json_writer(tmp_path, write_threads):
+    expected = render_output(JSONWriter(2, None), tmp_path, make_entries(tmp_path))
+    assert render_output(StreamingJSONWriter(2, None), tmp_path, make_entries(tmp_path), write_threads) == expected
+    assert zoom_ranges(expected) == [("road", 10, 11), ("rail", 11, 11), ("rail", 12, 12)]
+    assert all(e["bytes"] > 0 for e in json.loads(expected))
+
+
+def test_json_lines(tmp_path):
+    output = render_output(StreamingJSONWriter(2, None, json_lines=True), tmp_path, make_entries(tmp_path))
+    assert [ json.loads(line)["minzoom"] for line in output.splitlines() ] == [10, 11, 12]
+
+
+@pytest.mark.parametrize("write_threads", [0, 2])
+def test_streaming_html_writer(tmp_path, write_threads):
+    expected = render_output(HTMLWriter(2, TEMPLATE), tmp_path, make_entries(tmp_path))
+    assert render_output(StreamingHTMLWriter(2, TEMPLATE), tmp_path, make_entries(tmp_path), write_threads) == expected
+    assert expected.count("<tr") == 4
+    assert "None" not in expected
+
+
+def test_abort_stops_streaming_html_writer(tmp_path):
+    writer = StreamingHTMLWriter(2, TEMPLATE)
+    output = LegendOutput(writer, io.StringIO(), str(tmp_path), CacheStats(), None, write_threads=1)
+    legend_entry = make_entries(tmp_path)[0]
+    output.add(RenderTask(0, {"name": "road"}, 10, {}), legend_entry)
+    output.abort()
+    assert not writer.thread.is_alive()
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+import io
+import json
+import logging
+import os
+import yaml
+from mapnik_legendary import generate_legend, JSONWriter
+from mapnik_legendary.layer_styles import LayerStyles
+from mapnik_legendary.renderer import load_map
+from mapnik_legendary.zoom_analysis import scale_denominator, ZoomAnalysis
+
+# The rules of primary roads change between zoom levels 12 and 13, the ones of tracks on zoom
+# levels 16 and 17. Points change on zoom level 15.
+MAP_XML = """<Map>
+  <Style name="roads">
+    <Rule><Filter>[highway] = 'primary'</Filter><MinScaleDenominator>100000</MinScaleDenominator><LineSymbolizer stroke="#ff0000" stroke-width="2" /></Rule>
+    <Rule><Filter>[highway] = 'primary'</Filter><MaxScaleDenominator>100000</MaxScaleDenominator><LineSymbolizer stroke="#ff0000" stroke-width="5" /></Rule>
+    <Rule><Filter>[highway] = 'track'</Filter><MaxScaleDenominator>12500</MaxScaleDenominator><LineSymbolizer stroke="#996600" stroke-width="1" /></Rule>
+    <Rule><Filter>[highway] = 'track'</Filter><MaxScaleDenominator>6000</MaxScaleDenominator><LineSymbolizer stroke="#996600" stroke-width="3" /></Rule>
+    <Rule><Filter>[mapnik::geometry_type] = point</Filter><MaxScaleDenominator>25000</MaxScaleDenominator><MarkersSymbolizer fill="#0000ff" width="6" height="6" allow-overlap="true" /></Rule>
+  </Style>
+  <Layer name="roads"><StyleName>roads</StyleName></Layer>
+</Map>
+"""
+
+
+def feature(name, highway, geom_type="linestring"):
+    return {"name": name, "type": geom_type, "tags": {"highway": highway}, "layers": ["roads"], "min_zoom": 10, "max_zoom": 18}
+
+
+def make_analysis():
+    mapnik_map = load_map(MAP_XML, "", 100, 60)
+    return ZoomAnalysis(mapnik_map, LayerStyles(mapnik_map.layers), ["ref"])
+
+
+def test_scale_denominator():
+    assert scale_denominator(12) > 100000 > scale_denominator(13)
+    assert scale_denominator(16) < 12500 < scale_denominator(15)
+
+
+def test_rules_of_other_tags_do_not_split_zoom_ranges():
+    analysis = make_analysis()
+    assert analysis.zoom_groups(feature("primary", "primary"), 10, 18) == [(10, 12), (13, 18)]
+    assert analysis.zoom_groups(feature("track", "track"), 10, 18) == [(10, 15), (16, 16), (17, 18)]
+    assert analysis.zoom_groups(feature("path", "path"), 10, 18) == [(10, 18)]
+    # Filters on the geometry type are evaluated on the geometry of the part.
+    assert analysis.zoom_groups(feature("stop", "bus_stop", "point"), 10, 18) == [(10, 14), (15, 18)]
+    parts = {"name": "both", "parts": [feature("p", "primary"), feature("t", "track")], "min_zoom": 10, "max_zoom": 18}
+    assert analysis.zoom_groups(parts, 10, 18) == [(10, 12), (13, 15), (16, 16), (17, 18)]
+
+
+def run(tmp_path, name, **kwargs):
+    """Render the legend with generate_legend and return the entries with the name and content of their image."""
+    legend = {"width": 40, "height": 20, "features": [feature("primary", "primary"), feature("track", "track"), feature("stop", "bus_stop", "point")]}
+    images_dir = tmp_path / name
+    images_dir.mkdir()
+    (tmp_path / "style.xml").write_text(MAP_XML)
+    output = io.StringIO()
+    with open(str(tmp_path / "style.xml"), "r") as map_file:
+        result = generate_legend(
+            io.StringIO(yaml.safe_dump(legend)), map_file, JSONWriter, output_file=output,
+            images_directory=str(images_dir), **kwargs
+        )
+    if kwargs.get("dry_run"):
+        return result
+    entries = json.loads(output.getvalue())
+    for entry in entries:
+        with open(entry["image"], "rb") as image_file:
+            entry["image"] = (os.path.basename(entry["image"]), image_file.read())
+    return entries
+
+
+def test_skipped_zoom_levels_look_the_same(tmp_path, caplog):
+    assert len(run(tmp_path, "plan", dry_run=True).tasks) == 3 * 9
+    # One render per range of zoom levels instead of one per zoom level
+    assert len(run(tmp_path, "plan-skip", dry_run=True, skip_identical_zooms=True).tasks) == 2 + 3 + 2
+    skipped = run(tmp_path, "skipped", skip_identical_zooms=True)
+    assert [ (e["description"], e["minzoom"], e["maxzoom"]) for e in skipped ] == [
+        ("primary", 10, 12), ("primary", 13, 18),
+        ("track", 10, 15), ("track", 16, 16), ("track", 17, 18),
+        ("stop", 10, 14), ("stop", 15, 18),
+    ]
+    # Rendering all zoom levels results in the same entries and images.
+    assert run(tmp_path, "all") == skipped
+    with caplog.at_level(logging.WARNING, logger="mapnik-legendary"):
+        assert run(tmp_path, "verified", verify_skipped_zooms=True) == skipped
+    assert "Zoom analysis expected" not in caplog.text